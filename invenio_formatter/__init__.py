@@ -21,12 +21,19 @@
 """Format records using chosen format."""
 
 from .api import get_output_format_content_type
-from .engine import format_record, format_records
-from .utils import response_formated_records
+from .engine import format_record, format_record_async, format_records, \
+    format_records_async, iter_format_records
+from .records import LazyRecords
+from .utils import response_formated_record, response_formated_records
 
 __all__ = (
+    'LazyRecords',
     'format_record',
+    'format_record_async',
     'format_records',
+    'format_records_async',
     'get_output_format_content_type',
+    'iter_format_records',
+    'response_formated_record',
     'response_formated_records',
 )
@@ -92,3 +92,19 @@ def get_output_format_content_type(code, default_content_type='text/html'):
     """
     return get_format_property(code, 'content_type', default_content_type) or \
         default_content_type
+
+
+def get_output_format_fields(code):
+    """
+    Returns the record fields needed by the output format given by code
+
+    Record loaders can use the fields to fetch partial records.
+
+    :param code: the code of the output format
+    :return: frozenset of top-level field names or None if the whole record
+        is needed
+    """
+    f_code = code
+    if len(code) > 6:
+        f_code = code[:6]
+    return registry.output_formats_fields.get(f_code.lower())
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Content-addressed store of large cached renderings.
+
+Blobs are stored once per SHA-256 digest of their content in
+``<directory>/<aa>/<bb>/<digest>``, so identical renderings share one
+file.  The bibfmt table keeps only the digest of the rendering.
+"""
+
+import contextlib
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+from .config import CFG_BIBFORMAT_CACHE_BLOB_DIR
+
+
+class BlobStore(object):
+    """Store of immutable blobs addressed by their SHA-256 digest."""
+
+    def __init__(self, directory):
+        """Initialize the store in ``directory``."""
+        self.directory = directory
+
+    def path(self, digest):
+        """Return the path of the blob ``digest``."""
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        """Store ``data`` unless it is already stored.
+
+        :return: the digest of ``data``
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            try:
+                # a recent blob is not removed while its row is written
+                os.utime(path, None)
+                return digest
+            except OSError:
+                pass  # removed meanwhile, stored again
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        return digest
+
+    def exists(self, digest):
+        """Check if the blob ``digest`` is stored."""
+        return os.path.isfile(self.path(digest))
+
+    @contextlib.contextmanager
+    def open(self, digest):
+        """Map the blob ``digest`` in memory for reading."""
+        with open(self.path(digest), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                yield b''
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            data.close()
+
+    def digests(self):
+        """Iterate over the digests of the stored blobs."""
+        for root, dummy, files in os.walk(self.directory):
+            for name in files:
+                if not name.startswith('.tmp-'):
+                    yield name
+
+    def remove_unused(self, used, min_age=3600):
+        """Remove blobs not in ``used`` older than ``min_age`` seconds.
+
+        Recent blobs are kept as their rows may not be committed yet.
+
+        :return: number of removed blobs
+        """
+        limit = time.time() - min_age
+        count = 0
+        for digest in list(self.digests()):
+            path = self.path(digest)
+            if digest not in used and os.path.getmtime(path) < limit:
+                os.remove(path)
+                count += 1
+        return count
+
+
+def get_blob_store():
+    """Return the configured blob store or ``None`` if it is disabled."""
+    from invenio.base.globals import cfg
+
+    directory = cfg.get('CFG_BIBFORMAT_CACHE_BLOB_DIR',
+                        CFG_BIBFORMAT_CACHE_BLOB_DIR)
+    if not directory:
+        return None
+    return BlobStore(directory)
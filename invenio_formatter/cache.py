@@ -0,0 +1,728 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Read and write formatted records cached in the bibfmt table."""
+
+import datetime
+import threading
+import time
+import uuid
+import zlib
+from itertools import islice
+
+from invenio.base.globals import cfg
+
+from six import text_type
+
+from .api import get_format_property
+from .blobs import get_blob_store
+from .config import CFG_BIBFORMAT_CACHE_BATCH_SIZE, \
+    CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE, CFG_BIBFORMAT_CACHE_ENCODING, \
+    CFG_BIBFORMAT_CACHE_LOCK_TIMEOUT, CFG_BIBFORMAT_CACHED_FORMATS, \
+    InvenioBibFormatError
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+def _gzip_compress(value):
+    """Compress ``value`` to the gzip format."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(value) + compressor.flush()
+
+
+def _gzip_decompress(value):
+    """Decompress ``value`` from the gzip format."""
+    return zlib.decompress(value, 16 + zlib.MAX_WBITS)
+
+
+def _zstd_compress(value):
+    """Compress ``value`` to the zstd format."""
+    return zstandard.ZstdCompressor().compress(value)
+
+
+def _zstd_decompress(value):
+    """Decompress ``value`` from the zstd format."""
+    return zstandard.ZstdDecompressor().decompress(value)
+
+
+encodings = {
+    '': (lambda value: value, lambda value: value),
+    'gzip': (_gzip_compress, _gzip_decompress),
+    'zstd': (_zstd_compress, _zstd_decompress),
+}
+"""Mapping of content encodings to ``(compress, decompress)`` functions."""
+
+decompressors = {
+    'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'zstd': lambda: zstandard.ZstdDecompressor().decompressobj(),
+}
+"""Mapping of content encodings to incremental decompressor factories."""
+
+STREAM_CHUNK_SIZE = 256 * 1024
+"""Number of stored bytes read at once when streaming a cached value."""
+
+BLOB_PREFIX = 'blob:'
+"""Prefix of the encoding of values kept in the blob store.
+
+The value of such rows is the digest of the encoded rendering in the store.
+"""
+
+
+def get_cache_encoding(of):
+    """Return the content encoding used to cache output format ``of``."""
+    encoding = get_format_property(of, 'cache_encoding', cfg.get(
+        'CFG_BIBFORMAT_CACHE_ENCODING', CFG_BIBFORMAT_CACHE_ENCODING)) or ''
+    if encoding == 'zstd' and zstandard is None:
+        encoding = 'gzip'
+    return encoding
+
+
+def encode_value(value, encoding):
+    """Encode text ``value`` with the content ``encoding``."""
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    try:
+        return encodings[encoding][0](value)
+    except KeyError:
+        raise InvenioBibFormatError(
+            "Unknown cache encoding '{0}'".format(encoding))
+
+
+def store_value(value, encoding):
+    """Encode text ``value`` for the bibfmt table.
+
+    Encoded values larger than ``CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE`` are put
+    in the blob store when it is enabled.
+
+    :return: tuple of the stored value and its encoding
+    """
+    value = encode_value(value, encoding)
+    store = get_blob_store()
+    if store is not None and len(value) >= cfg.get(
+            'CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE',
+            CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE):
+        return store.put(value).encode('ascii'), BLOB_PREFIX + encoding
+    return value, encoding
+
+
+def content_encoding(encoding):
+    """Return the content encoding of a value stored with ``encoding``."""
+    if encoding and encoding.startswith(BLOB_PREFIX):
+        return encoding[len(BLOB_PREFIX):]
+    return encoding or ''
+
+
+def can_decode(encoding):
+    """Check if values stored with ``encoding`` can be decoded here."""
+    encoding = content_encoding(encoding)
+    if encoding == 'zstd':
+        return zstandard is not None
+    return encoding in encodings
+
+
+def decode_value(value, encoding):
+    """Decode cached ``value`` stored with the content ``encoding``."""
+    if encoding and encoding.startswith(BLOB_PREFIX):
+        store = get_blob_store()
+        if store is None:
+            raise InvenioBibFormatError("The blob store is disabled")
+        try:
+            with store.open(value.decode('ascii')) as data:
+                return decode_value(data, content_encoding(encoding))
+        except (IOError, OSError):
+            raise InvenioBibFormatError(
+                "Missing blob '{0}'".format(value.decode('ascii')))
+    if not can_decode(encoding):
+        raise InvenioBibFormatError(
+            "Cannot decode cache encoding '{0}'".format(encoding))
+    try:
+        value = encodings[encoding or ''][1](value)
+    except KeyError:
+        raise InvenioBibFormatError(
+            "Unknown cache encoding '{0}'".format(encoding))
+    return value[:].decode('utf-8')
+
+
+FRAGMENT_GENERATION_KEY = 'formatter::fragment::generation'
+"""Shared cache key of the current generation of template fragments."""
+
+
+def new_fragment_generation():
+    """Start a new generation of template fragments.
+
+    Fragments cached by previous generations are never read again and
+    expire from the shared cache.
+    """
+    from invenio.ext.cache import cache
+
+    generation = uuid.uuid4().hex
+    cache.set(FRAGMENT_GENERATION_KEY, generation)
+    return generation
+
+
+def fragment_key(key, ln):
+    """Return the shared cache key of fragment ``key`` in language ``ln``."""
+    from invenio.ext.cache import cache
+
+    generation = cache.get(FRAGMENT_GENERATION_KEY) or \
+        new_fragment_generation()
+    return 'formatter::fragment::{0}::{1}::{2}'.format(generation, ln, key)
+
+
+def get_fragment(key):
+    """Return the template fragment cached under ``key`` or None.
+
+    :param key: shared cache key returned by :func:`fragment_key`
+    """
+    from invenio.ext.cache import cache
+
+    return cache.get(key)
+
+
+def set_fragment(key, value, timeout=None):
+    """Cache the rendered template fragment under ``key``.
+
+    :param key: shared cache key returned by :func:`fragment_key`
+    """
+    from invenio.ext.cache import cache
+
+    cache.set(key, text_type(value), timeout=timeout)
+
+
+def is_cached_format(of):
+    """Check if the output format ``of`` is cached in the bibfmt table."""
+    cached_formats = cfg.get('CFG_BIBFORMAT_CACHED_FORMATS',
+                             CFG_BIBFORMAT_CACHED_FORMATS)
+    return of.lower() in [code.lower() for code in cached_formats]
+
+
+def get_generation(of, session=None):
+    """Return the current cache generation of output format ``of``.
+
+    :param session: database session used instead of the one of the
+        application
+    """
+    from invenio.ext.sqlalchemy import db
+    from .models import BibfmtGeneration
+
+    generation = (session or db.session).query(
+        BibfmtGeneration.generation).filter(
+        BibfmtGeneration.format == of.upper()).scalar()
+    return generation or 0
+
+
+def get_cached(recid, of, with_value=True, session=None):
+    """Return the cached row of record ``recid`` in format ``of`` or None.
+
+    :param with_value: load the cached value with the row; otherwise only
+        rows having a value are returned, which can then be read with
+        :func:`iter_value_chunks`
+
+    :param session: database session used instead of the one of the
+        application
+
+    Rows stored with an encoding that cannot be decoded here (e.g. zstd
+    without the zstandard package) and rows whose blob is missing are
+    treated as missing.
+    """
+    from invenio.ext.sqlalchemy import db
+    from .models import Bibfmt, BibfmtGeneration
+
+    query = (session or db.session).query(Bibfmt).outerjoin(
+        BibfmtGeneration, BibfmtGeneration.format == Bibfmt.format
+    ).filter(
+        Bibfmt.id_bibrec == recid,
+        Bibfmt.format == of.upper(),
+        db.or_(BibfmtGeneration.generation.is_(None),
+               Bibfmt.generation >= BibfmtGeneration.generation)
+    )
+    if with_value:
+        query = query.options(db.undefer('value'))
+    else:
+        query = query.filter(Bibfmt.value.isnot(None))
+    row = query.first()
+    if row is None or not can_decode(row.encoding):
+        return None
+    if row.encoding.startswith(BLOB_PREFIX) and row.value is not None:
+        store = get_blob_store()
+        if store is None or not store.exists(row.value.decode('ascii')):
+            return None
+    return row
+
+
+def iter_value_chunks(row, chunk_size=None):
+    """Yield the stored value of a bibfmt ``row`` in chunks of bytes.
+
+    The value is read from the database ``chunk_size`` bytes at a time so
+    that large renderings are never loaded whole.  Values of the blob store
+    are read from their file.
+    """
+    from invenio.ext.sqlalchemy import db
+    from .models import Bibfmt
+
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    if row.encoding.startswith(BLOB_PREFIX):
+        with get_blob_store().open(row.value.decode('ascii')) as data:
+            for start in range(0, len(data), chunk_size):
+                yield bytes(data[start:start + chunk_size])
+        return
+
+    offset = 1
+    while True:
+        chunk = db.session.query(
+            db.func.substr(Bibfmt.value, offset, chunk_size)
+        ).filter(
+            Bibfmt.id_bibrec == row.id_bibrec,
+            Bibfmt.format == row.format,
+            Bibfmt.last_updated == row.last_updated
+        ).scalar()
+        if chunk is None:
+            raise InvenioBibFormatError(
+                "Cached value of {0} in format {1} changed while it was "
+                "read".format(row.id_bibrec, row.format))
+        if chunk:
+            yield bytes(chunk)
+        if len(chunk) < chunk_size:
+            return
+        offset += chunk_size
+
+
+def iter_decoded_value(row, chunk_size=None):
+    """Yield the decompressed value of a bibfmt ``row`` in chunks of bytes.
+
+    The text is encoded in UTF-8.
+    """
+    encoding = content_encoding(row.encoding)
+    chunks = iter_value_chunks(row, chunk_size)
+    if not encoding:
+        return chunks
+    try:
+        decompressor = decompressors[encoding]()
+    except KeyError:
+        raise InvenioBibFormatError(
+            "Unknown cache encoding '{0}'".format(encoding))
+    return _decompress(chunks, decompressor)
+
+
+def _decompress(chunks, decompressor):
+    """Decompress ``chunks`` one by one."""
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def get_cached_value(recid, of):
+    """Return the cached rendering of record ``recid`` as text or None."""
+    row = get_cached(recid, of)
+    if row is None or row.value is None:
+        return None
+    return decode_value(row.value, row.encoding)
+
+
+def set_cached_value(recid, of, value, kind='', needs_2nd_pass=False,
+                     last_updated=None, generation=None):
+    """Store the rendering ``value`` of record ``recid`` in format ``of``.
+
+    The row is written in its own transaction, leaving the session of the
+    application untouched.
+
+    :param generation: generation of ``of`` read before the rendering
+        started (defaults to the current one)
+    """
+    bulk_set_cached_values([(recid, of, kind, value, last_updated,
+                             needs_2nd_pass, generation)])
+
+
+_UPSERT_COLUMNS = ('kind', 'last_updated', 'value', 'encoding',
+                   'needs_2nd_pass', 'generation')
+
+
+def _upsert_statement(dialect):
+    """Return an upsert statement of the bibfmt table for ``dialect``.
+
+    Return ``None`` when the dialect (or the installed SQLAlchemy) does not
+    support it.
+    """
+    from .models import Bibfmt
+
+    table = Bibfmt.__table__
+    try:
+        if dialect.name == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table)
+            return stmt.on_duplicate_key_update(
+                **dict((c, stmt.inserted[c]) for c in _UPSERT_COLUMNS))
+        elif dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            return None
+        stmt = insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=['id_bibrec', 'format'],
+            set_=dict((c, stmt.excluded[c]) for c in _UPSERT_COLUMNS))
+    except (ImportError, AttributeError):
+        return None
+
+
+def _delete_statement():
+    """Return a statement deleting one bibfmt row given by bound values."""
+    from sqlalchemy import bindparam
+    from .models import Bibfmt
+
+    table = Bibfmt.__table__
+    return table.delete().where(
+        (table.c.id_bibrec == bindparam('b_id_bibrec')) &
+        (table.c.format == bindparam('b_format')))
+
+
+def bulk_set_cached_values(rows, batch_size=None, connectable=None):
+    """Insert or update many cached renderings.
+
+    Rows are written in batches with one ``executemany`` statement per batch,
+    using ``INSERT ... ON DUPLICATE KEY UPDATE`` on MySQL and
+    ``INSERT ... ON CONFLICT`` on PostgreSQL and SQLite.  Other databases
+    delete the rows of a batch with one ``executemany`` statement and insert
+    them with another one, in one transaction.
+
+    :param rows: iterable of ``(id_bibrec, format, kind, value, last_updated,
+        needs_2nd_pass)`` tuples, ``value`` being the rendering as text; an
+        optional seventh item gives the generation of the format read before
+        the rendering started (the current one when missing or ``None``)
+    :param batch_size: number of rows per batch (defaults to
+        ``CFG_BIBFORMAT_CACHE_BATCH_SIZE``)
+    :param connectable: engine used to write the rows (defaults to the
+        engine of the application)
+    :return: number of written rows
+    """
+    from .models import Bibfmt
+
+    if connectable is None:
+        from invenio.ext.sqlalchemy import db
+        connectable = db.engine
+
+    batch_size = batch_size or cfg.get('CFG_BIBFORMAT_CACHE_BATCH_SIZE',
+                                       CFG_BIBFORMAT_CACHE_BATCH_SIZE)
+    upsert = _upsert_statement(connectable.dialect)
+    table = Bibfmt.__table__
+    encodings = {}
+    generations = {}
+    rows = iter(rows)
+    count = 0
+
+    while True:
+        batch = []
+        for row in islice(rows, batch_size):
+            recid, of, kind, value, last_updated, needs_2nd_pass = row[:6]
+            generation = row[6] if len(row) > 6 else None
+            if of not in encodings:
+                encodings[of] = get_cache_encoding(of)
+            if generation is None:
+                if of not in generations:
+                    generations[of] = get_generation(of)
+                generation = generations[of]
+            value, encoding = store_value(value, encodings[of])
+            batch.append(dict(
+                id_bibrec=recid,
+                format=of.upper(),
+                kind=kind or '',
+                last_updated=last_updated or datetime.datetime.now(),
+                value=value,
+                encoding=encoding,
+                needs_2nd_pass=int(bool(needs_2nd_pass)),
+                generation=generation,
+            ))
+        if not batch:
+            break
+
+        with connectable.begin() as connection:
+            if upsert is not None:
+                connection.execute(upsert, batch)
+            else:
+                connection.execute(_delete_statement(), [
+                    {'b_id_bibrec': row['id_bibrec'],
+                     'b_format': row['format']} for row in batch])
+                connection.execute(table.insert(), batch)
+        count += len(batch)
+    return count
+
+
+def invalidate(of):
+    """Invalidate all cached renderings of output format ``of``.
+
+    Only the generation of the output format is increased; the obsolete
+    rows are removed by :func:`purge` in a background task.  Cached
+    template fragments are invalidated as well.
+
+    :return: the new generation number
+    """
+    from .tasks import purge_cache
+    from invenio.ext.sqlalchemy import db
+    from .models import BibfmtGeneration
+
+    generation = BibfmtGeneration.query.get(of.upper())
+    if generation is None:
+        generation = BibfmtGeneration(format=of.upper(), generation=0)
+        db.session.add(generation)
+    generation.generation += 1
+    generation.invalidated = datetime.datetime.now()
+    db.session.commit()
+    new_fragment_generation()
+    purge_cache.delay(of)
+    return generation.generation
+
+
+def iter_stale(of, older_than=None, kind=None, batch_size=None):
+    """Iterate over cached renderings of ``of`` updated before a date.
+
+    Rows are read in pages ordered by ``(last_updated, id_bibrec)`` using the
+    ``(format, last_updated)`` index, each page starting after the last row
+    of the previous one instead of using an ``OFFSET``.  Only indexed
+    columns are read, in a session of their own ending its transaction
+    after every page.
+
+    :param older_than: date before which renderings are stale (``None``
+        iterates over all the renderings of ``of``)
+    :param kind: restrict the rows to renderings of this kind
+    :return: iterator of ``(id_bibrec, last_updated)`` tuples
+    """
+    from sqlalchemy.orm import Session
+    from invenio.ext.sqlalchemy import db
+    from .models import Bibfmt
+
+    batch_size = batch_size or cfg.get('CFG_BIBFORMAT_CACHE_BATCH_SIZE',
+                                       CFG_BIBFORMAT_CACHE_BATCH_SIZE)
+    session = Session(bind=db.engine)
+    try:
+        query = session.query(Bibfmt.id_bibrec, Bibfmt.last_updated).filter(
+            Bibfmt.format == of.upper())
+        if older_than is not None:
+            query = query.filter(Bibfmt.last_updated < older_than)
+        if kind is not None:
+            query = query.filter(Bibfmt.kind == kind)
+        query = query.order_by(Bibfmt.last_updated, Bibfmt.id_bibrec)
+
+        page = query.limit(batch_size).all()
+        while page:
+            session.commit()
+            for row in page:
+                yield row
+            last_recid, last_updated = page[-1]
+            page = query.filter(db.or_(
+                Bibfmt.last_updated > last_updated,
+                db.and_(Bibfmt.last_updated == last_updated,
+                        Bibfmt.id_bibrec > last_recid))
+            ).limit(batch_size).all()
+    finally:
+        session.close()
+
+
+def purge(of, chunk_size=None, throttle=0.1):
+    """Delete cached renderings of ``of`` older than its current generation.
+
+    Obsolete rows are read in pages of ``chunk_size`` records ordered by
+    record identifier, each page starting after the last record of the
+    previous one, and deleted page by page, each in its own transaction,
+    sleeping ``throttle`` seconds between pages so that locks are held only
+    briefly.  The rows are read in a session of their own.
+
+    :return: number of deleted rows
+    """
+    from sqlalchemy.orm import Session
+    from invenio.ext.sqlalchemy import db
+    from .models import Bibfmt
+
+    chunk_size = chunk_size or cfg.get('CFG_BIBFORMAT_CACHE_BATCH_SIZE',
+                                       CFG_BIBFORMAT_CACHE_BATCH_SIZE)
+    table = Bibfmt.__table__
+    session = Session(bind=db.engine)
+    try:
+        generation = get_generation(of, session=session)
+        session.commit()
+        if not generation:
+            return 0
+
+        query = session.query(Bibfmt.id_bibrec).filter(
+            Bibfmt.format == of.upper(), Bibfmt.generation < generation
+        ).order_by(Bibfmt.id_bibrec)
+        count = 0
+        last_recid = None
+        while True:
+            page = query if last_recid is None else \
+                query.filter(Bibfmt.id_bibrec > last_recid)
+            recids = [recid for recid, in page.limit(chunk_size)]
+            session.commit()
+            if not recids:
+                return count
+            with db.engine.begin() as connection:
+                count += connection.execute(table.delete().where(
+                    (table.c.format == of.upper()) &
+                    table.c.id_bibrec.in_(recids) &
+                    (table.c.generation < generation)
+                )).rowcount
+            last_recid = recids[-1]
+            if throttle:
+                time.sleep(throttle)
+    finally:
+        session.close()
+
+
+def purge_blobs(min_age=3600):
+    """Remove blobs not used by any row of the bibfmt table.
+
+    :return: number of removed blobs
+    """
+    from sqlalchemy.orm import Session
+    from invenio.ext.sqlalchemy import db
+    from .models import Bibfmt
+
+    store = get_blob_store()
+    if store is None:
+        return 0
+    session = Session(bind=db.engine)
+    try:
+        used = set(value.decode('ascii') for value, in session.query(
+            Bibfmt.value).filter(Bibfmt.encoding.like(BLOB_PREFIX + '%')))
+    finally:
+        session.close()
+    return store.remove_unused(used, min_age=min_age)
+
+
+class _Call(object):
+    """In-flight call of :class:`SingleFlight`."""
+
+    def __init__(self):
+        """Initialize the call."""
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls with the same key into a single call.
+
+    The first caller of a key runs the function, the other threads of the
+    process wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        """Initialize the registry of in-flight calls."""
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, f):
+        """Return the result of ``f()`` computed once for concurrent calls."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = f()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+renders = SingleFlight()
+"""Registry of in-flight renders of cached formats."""
+
+
+def render_once(recid, of, ln, render, variance='', is_fresh=None):
+    """Render a cached format once for concurrent requests.
+
+    Threads of the process wait for the in-flight render of the same
+    ``(recid, of, ln, variance)``.  When ``CFG_BIBFORMAT_CACHE_LOCK_TIMEOUT``
+    is set, other processes are coordinated with a lock in the shared
+    cache: they wait for the holder to store the rendering in the bibfmt
+    table, and render themselves only when the lock expires.
+
+    :param render: function rendering and caching the record, returning
+        ``(value, needs_2nd_pass)``
+    :param is_fresh: function telling if a cached row stored meanwhile can
+        be served (defaults to any row)
+    """
+    key = (recid, of.lower(), ln, variance)
+    return renders.do(key, lambda: _render_locked(key, render, is_fresh))
+
+
+def _get_stored(recid, of, is_fresh):
+    """Return the stored rendering of ``recid`` in ``of`` or None.
+
+    A new session is used for every call so that rows committed by other
+    processes since the previous call are seen.
+    """
+    from sqlalchemy.orm import Session
+    from invenio.ext.sqlalchemy import db
+
+    session = Session(bind=db.engine)
+    try:
+        row = get_cached(recid, of, session=session)
+        if row is None or row.value is None or \
+                (is_fresh is not None and not is_fresh(row)):
+            return None
+        return decode_value(row.value, row.encoding), row.needs_2nd_pass
+    except InvenioBibFormatError:
+        return None
+    finally:
+        session.close()
+
+
+def _render_locked(key, render, is_fresh=None):
+    """Render holding the lock of ``key`` in the shared cache."""
+    from invenio.ext.cache import cache
+
+    timeout = cfg.get('CFG_BIBFORMAT_CACHE_LOCK_TIMEOUT',
+                      CFG_BIBFORMAT_CACHE_LOCK_TIMEOUT)
+    if not timeout:
+        return render()
+
+    lock_key = 'formatter::render::{0}'.format(':'.join(map(str, key)))
+    deadline = time.time() + timeout
+    while not cache.add(lock_key, 1, timeout=timeout):
+        stored = _get_stored(key[0], key[1], is_fresh)
+        if stored is not None:
+            return stored
+        if time.time() > deadline:
+            return render()
+        time.sleep(0.05)
+
+    try:
+        return render()
+    finally:
+        cache.delete(lock_key)
@@ -34,9 +34,111 @@ CFG_BIBFORMAT_FORMAT_OUTPUT_EXTENSION = "bfo"
 
 # CFG_BIBFORMAT_CACHED_FORMATS -- Specify a list of cached formats
 # We need to know which ones are cached because bibformat will save the
-# of these in a db table
+# of these in a db table.  Cached formats are rendered as a guest and
+# served to guests only: logged-in users, who may see restricted content,
+# always get a fresh rendering.
 CFG_BIBFORMAT_CACHED_FORMATS = []
 
+# CFG_BIBFORMAT_CACHE_ENCODING -- content encoding used to compress the
+# cached formats ('gzip', 'zstd' if the zstandard package is installed or
+# '' to store them uncompressed).  Output formats can override it with the
+# `cache_encoding` property.  Rows stored with an encoding that cannot be
+# decoded by a node are treated as cache misses by that node.
+CFG_BIBFORMAT_CACHE_ENCODING = ''
+
+# CFG_BIBFORMAT_CACHE_BATCH_SIZE -- number of cached formats written by
+# one statement of `invenio_formatter.cache.bulk_set_cached_values`.
+CFG_BIBFORMAT_CACHE_BATCH_SIZE = 1000
+
+# CFG_BIBFORMAT_CACHE_LOCK_TIMEOUT -- number of seconds a process renders
+# a missing cached format while holding a lock in the shared cache, so that
+# other processes wait for its result.  0 coordinates only the threads of
+# a process.
+CFG_BIBFORMAT_CACHE_LOCK_TIMEOUT = 0
+
+# CFG_BIBFORMAT_CACHE_BLOB_DIR -- directory of the content-addressed store
+# keeping cached formats larger than CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE
+# outside of the bibfmt table, or None to keep all of them in the table.
+CFG_BIBFORMAT_CACHE_BLOB_DIR = None
+
+# CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE -- encoded size in bytes from which a
+# cached format is kept in the blob store.
+CFG_BIBFORMAT_CACHE_BLOB_MIN_SIZE = 64 * 1024
+
+# CFG_BIBFORMAT_REFRESH_BACKEND -- queue of stale cached formats served
+# while they are rendered again (see the `stale_while_revalidate` property
+# of output formats): 'threads' for worker threads of the web process or
+# 'table' for the `bibfmt_refresh` table processed by `refresh` command.
+CFG_BIBFORMAT_REFRESH_BACKEND = 'threads'
+
+# CFG_BIBFORMAT_REFRESH_WORKERS -- number of worker threads per process.
+CFG_BIBFORMAT_REFRESH_WORKERS = 2
+
+# CFG_BIBFORMAT_REFRESH_QUEUE_SIZE -- maximum number of queued records per
+# process; stale records are not queued when the queue is full.
+CFG_BIBFORMAT_REFRESH_QUEUE_SIZE = 1000
+
+# CFG_BIBFORMAT_NATIVE_FORMATS -- list of output formats rendered by the
+# native serializers in `invenio_formatter.serializers` instead of the
+# Jinja templates in `format/records/`.  Output formats using an XSLT
+# format template (e.g. xd, xn, xr) can be added to transform the records
+# of a page from a single parsed collection with the cached compiled
+# stylesheet; their collection template still wraps the records.
+# Empty by default, add e.g. ['recjson', 'xm'] once
+# `tests/test_serializers.py` passes in the site environment; it checks
+# that the serializers render the same documents as the templates.
+CFG_BIBFORMAT_NATIVE_FORMATS = []
+
+# CFG_BIBFORMAT_RENDER_THREADS -- number of threads rendering the records
+# of a page concurrently for output formats with the `parallel` property.
+CFG_BIBFORMAT_RENDER_THREADS = 4
+
+# CFG_BIBFORMAT_OFFLOAD_PROCESSES -- number of worker processes rendering
+# large exports of guests in output formats with the `offload` property
+# (0 disables the offloading).  The processes start with the application,
+# which must be loaded in every server worker (e.g. uWSGI `lazy-apps`).
+CFG_BIBFORMAT_OFFLOAD_PROCESSES = 0
+
+# CFG_BIBFORMAT_OFFLOAD_MIN_RECORDS -- minimal number of records of an
+# export to offload it to the worker processes.
+CFG_BIBFORMAT_OFFLOAD_MIN_RECORDS = 500
+
+# CFG_BIBFORMAT_OFFLOAD_CHUNK_SIZE -- number of records sent at once to a
+# worker process.
+CFG_BIBFORMAT_OFFLOAD_CHUNK_SIZE = 100
+
+# CFG_BIBFORMAT_RECORDS_LOADER -- import path of the function loading
+# the records of a results page from a list of record identifiers.  It is
+# called once per page by `invenio_formatter.records.LazyRecords` with the
+# `fields` keyword argument listing the top-level fields to load (or None
+# for whole records).
+CFG_BIBFORMAT_RECORDS_LOADER = 'invenio_formatter.records:load_records'
+
+# CFG_BIBFORMAT_HITS_CACHE_TIMEOUT -- number of seconds the hits of the
+# last search are kept in the shared cache for back-to-search links.
+CFG_BIBFORMAT_HITS_CACHE_TIMEOUT = 3600
+
+# CFG_BIBFORMAT_EXPORT_DIR -- directory where the `export` command of the
+# formatter manager writes the dumps, one subdirectory per output format.
+# Defaults to `<CFG_CACHEDIR>/formatter/export`.
+CFG_BIBFORMAT_EXPORT_DIR = None
+
+# CFG_BIBFORMAT_EXPORT_FILE_SIZE -- compressed size in bytes after which
+# an export file is closed and the next one is started.
+CFG_BIBFORMAT_EXPORT_FILE_SIZE = 256 * 1024 * 1024
+
+# CFG_BIBFORMAT_EXPORT_ACCEL_REDIRECT -- internal location of the export
+# directory in nginx (e.g. '/protected/export/').  When set, export files
+# are served by nginx with X-Accel-Redirect; with USE_X_SENDFILE they are
+# served by the web server with X-Sendfile.
+CFG_BIBFORMAT_EXPORT_ACCEL_REDIRECT = None
+
+# CFG_BIBFORMAT_EXPORT_ACCESS_ACTION -- access action users must be
+# authorized for to download exports.  Exports only contain public records,
+# so None lets everybody, harvesters included, download them; set it to
+# e.g. 'runbibformat' to restrict them.
+CFG_BIBFORMAT_EXPORT_ACCESS_ACTION = None
+
 # Exceptions: errors
 
 
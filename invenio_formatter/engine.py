@@ -19,20 +19,42 @@
 
 """Format a single record using specified format."""
 
+import base64
+import datetime
+import json
 import re
+import threading
 import time
 import types
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_login import current_user
 
 from invenio.base.globals import cfg
 from invenio.base.i18n import language_list_long
 from invenio.ext.template import render_template_to_string
 
+from markupsafe import Markup
+
+from six import iteritems, text_type
+
 from werkzeug.utils import cached_property
 
 from . import registry
-from .api import get_output_format_content_type
-from .config import InvenioBibFormatError
+from .api import get_format_property, get_output_format_content_type, \
+    get_output_format_fields
+from .cache import decode_value, get_cached, get_generation, \
+    is_cached_format, render_once, set_cached_value
+from .config import CFG_BIBFORMAT_NATIVE_FORMATS, \
+    CFG_BIBFORMAT_RENDER_THREADS, InvenioBibFormatError
+from .offload import OffloadedRecords, load_record, offload_records, \
+    should_offload
+from .records import LazyRecords
 from .registry import template_context_functions
+from .serializers import native_formats, xslt
 
 # Cache for data we have already read and parsed
 format_templates_cache = {}
@@ -142,11 +164,73 @@ pattern_format_element_seealso = re.compile(r'''@see:\s*(?P<see>.*)''',
 
 sub_non_alnum = re.compile('[^0-9a-zA-Z]+')
 
+# Header of a first pass rendering giving the nonce of its placeholders;
+# record content cannot forge placeholders as the nonce is drawn after it
+# is written
+SECOND_PASS_HEADER = '<!--BIBFMT2ND:{0}-->'
+
+# Placeholder of a template context function call left by the first pass
+SECOND_PASS_PLACEHOLDER = '<!--BIBFMT2ND:{0}:{1}:{2}-->'
+
+# Regular expression for finding the header of a first pass rendering
+pattern_second_pass_header = re.compile(
+    r'<!--BIBFMT2ND:(?P<nonce>[0-9a-f]{32})-->')
+
+# Regular expression for finding placeholders left by the first pass
+pattern_second_pass = re.compile(
+    r'<!--BIBFMT2ND:(?P<nonce>[0-9a-f]{32}):(?P<name>\w+):'
+    r'(?P<args>[A-Za-z0-9_=-]*)-->')
+
 
 def fix_tag_name(s):
     return sub_non_alnum.sub('_', s.lower())
 
 
+def memoize_per_request(name, f):
+    """Memoize results of ``f`` for the duration of the current request.
+
+    Calls with unhashable arguments or outside of a request are not
+    memoized.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not has_request_context():
+            return f(*args, **kwargs)
+        key = (name, args, frozenset(iteritems(kwargs)))
+        try:
+            hash(key)
+        except TypeError:
+            return f(*args, **kwargs)
+        memo = getattr(g, '_formatter_context_functions', None)
+        if memo is None:
+            memo = g._formatter_context_functions = {}
+        if key not in memo:
+            memo[key] = f(*args, **kwargs)
+        return memo[key]
+    return decorated
+
+
+def defer_to_second_pass(name, f):
+    """Return a placeholder for calls of ``f`` during the first pass."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        state = getattr(g, '_formatter_first_pass', None)
+        if state is None:
+            return f(*args, **kwargs)
+        try:
+            payload = json.dumps([args, kwargs])
+        except (TypeError, ValueError):
+            # the call cannot be replayed, the rendering is not cached
+            state['cacheable'] = False
+            return f(*args, **kwargs)
+        state['needs_2nd_pass'] = True
+        payload = base64.urlsafe_b64encode(
+            payload.encode('utf-8')).decode('ascii')
+        return Markup(SECOND_PASS_PLACEHOLDER.format(state['nonce'], name,
+                                                     payload))
+    return decorated
+
+
 class LazyTemplateContextFunctionsCache(object):
     """Loads bibformat elements using plugin builder and caches results."""
 
@@ -158,10 +242,23 @@ class LazyTemplateContextFunctionsCache(object):
         for m in modules:
             register_func = getattr(m, 'template_context_function', None)
             if register_func and isinstance(register_func, types.FunctionType):
-                elem[m.__name__.split('.')[-1]] = register_func
+                name = m.__name__.split('.')[-1]
+                elem[name] = memoize_per_request(name, register_func)
+                if getattr(m, 'needs_2nd_pass', False):
+                    elem[name] = defer_to_second_pass(name, elem[name])
 
         return elem
 
+    def install(self, jinja_env):
+        """Expose template context functions as globals of ``jinja_env``.
+
+        The functions are shared by all renders instead of being copied into
+        every template context.
+        """
+        if not getattr(jinja_env, '_formatter_context_functions', False):
+            jinja_env.globals.update(self.template_context_functions)
+            jinja_env._formatter_context_functions = True
+
 TEMPLATE_CONTEXT_FUNCTIONS_CACHE = LazyTemplateContextFunctionsCache()
 
 
@@ -178,9 +275,92 @@ def format_record(record, of, ln=None, verbose=0, search_pattern=None,
     'xml_record' parameter). If 'xml_record' is specified 'recID' is
     ignored (but should still be given for reference. A dummy recid 0
     or -1 could be used).
+
+    Renderings of formats listed in ``CFG_BIBFORMAT_CACHED_FORMATS`` are
+    cached for guests only; logged-in users bypass the cache.
     """
+    from flask import current_app
+
     ln = ln or cfg['CFG_SITE_LANG']
+    TEMPLATE_CONTEXT_FUNCTIONS_CACHE.install(current_app.jinja_env)
+
+    # the cache holds renderings of guests only
+    if kwargs or ln != cfg['CFG_SITE_LANG'] or not is_cached_format(of) or \
+            not current_user.is_guest:
+        return _render_record(record, of, **kwargs)
+
+    row = get_cached(record['recid'], of)
+    out = None
+    if row is not None and row.value is not None and \
+            _can_serve_cached(record, of, row):
+        try:
+            out = decode_value(row.value, row.encoding)
+            needs_2nd_pass = row.needs_2nd_pass
+        except InvenioBibFormatError:
+            # rows that cannot be decoded are rendered again
+            out = None
+        if needs_2nd_pass and out is not None and \
+                not pattern_second_pass_header.match(out):
+            # rows cached before placeholders had a nonce
+            out = None
+    if out is None:
+        out, needs_2nd_pass = render_once(
+            record['recid'], of, ln, lambda: _render_and_cache(record, of),
+            is_fresh=lambda row: _can_serve_cached(record, of, row))
+
+    return second_pass(out) if needs_2nd_pass else out
+
+
+def _can_serve_cached(record, of, row):
+    """Check if the cached ``row`` of ``record`` can be served.
+
+    Renderings older than the last modification of the record are stale.
+    They are still served during the ``stale_while_revalidate`` number of
+    seconds of the output format, while the record is queued to be rendered
+    again in the background.  Records are loaded with their modification
+    date even when they are restricted to the formatted fields.
+    """
+    from .refresh import enqueue_refresh
+
+    modified = record.get('modification_date')
+    if not isinstance(modified, datetime.datetime) or \
+            row.last_updated >= modified:
+        return True
+    window = get_format_property(of, 'stale_while_revalidate', 0)
+    if window and datetime.datetime.now() - modified < \
+            datetime.timedelta(seconds=window):
+        enqueue_refresh(record['recid'], of)
+        return True
+    return False
 
+
+def render_first_pass(record, of):
+    """Render the first pass of a record as a guest.
+
+    :return: tuple of the rendering, whether it needs a second pass and
+        whether it can be cached
+    """
+    with as_guest(), first_pass() as state:
+        out = _render_record(record, of)
+    if state['needs_2nd_pass']:
+        out = SECOND_PASS_HEADER.format(state['nonce']) + out
+    return out, state['needs_2nd_pass'], state['cacheable']
+
+
+def _render_and_cache(record, of):
+    """Render the first pass of a record and store it in the cache."""
+    generation = get_generation(of)
+    started = datetime.datetime.now()
+    out, needs_2nd_pass, cacheable = render_first_pass(record, of)
+    if cacheable:
+        set_cached_value(record['recid'], of, out,
+                         needs_2nd_pass=needs_2nd_pass,
+                         last_updated=started, generation=generation)
+    return out, needs_2nd_pass
+
+
+def _render_record(record, of, **kwargs):
+    """Render a record with the format template decided for ``of``."""
     template = decide_format_template(record, of)
 
     out = render_template_to_string(
@@ -194,9 +374,157 @@ def format_record(record, of, ln=None, verbose=0, search_pattern=None,
     return out
 
 
+@contextmanager
+def as_guest():
+    """Render as an anonymous user, whatever the user of the request."""
+    from flask import _request_ctx_stack, current_app
+
+    ctx = _request_ctx_stack.top
+    missing = object()
+    previous = getattr(ctx, 'user', missing)
+    ctx.user = current_app.login_manager.anonymous_user()
+    try:
+        yield
+    finally:
+        if previous is missing:
+            del ctx.user
+        else:
+            ctx.user = previous
+
+
+@contextmanager
+def first_pass():
+    """Render user and request independent parts only.
+
+    Calls of template context functions marked with ``needs_2nd_pass``
+    return placeholders bound to the nonce of the rendering instead, and
+    the yielded state tells whether any placeholder was produced and
+    whether the rendering can be cached.
+    """
+    previous = getattr(g, '_formatter_first_pass', None)
+    state = g._formatter_first_pass = {'needs_2nd_pass': False,
+                                       'cacheable': True,
+                                       'nonce': uuid.uuid4().hex}
+    try:
+        yield state
+    finally:
+        g._formatter_first_pass = previous
+
+
+def second_pass(out):
+    """Replace placeholders left by the first pass in ``out``.
+
+    Only placeholders carrying the nonce of the header of ``out`` are
+    replaced; those of unknown functions are left untouched.
+    """
+    functions = TEMPLATE_CONTEXT_FUNCTIONS_CACHE.template_context_functions
+    header = pattern_second_pass_header.match(out)
+    if header is None:
+        return out
+    nonce = header.group('nonce')
+
+    def replace(match):
+        function = functions.get(match.group('name'))
+        if match.group('nonce') != nonce or function is None:
+            return match.group(0)
+        args, kwargs = json.loads(base64.urlsafe_b64decode(
+            match.group('args').encode('ascii')).decode('utf-8'))
+        return text_type(function(*args, **kwargs))
+
+    return pattern_second_pass.sub(replace, out[header.end():])
+
+
 def format_records(records, of='hb', ln=None, **ctx):
-    """Return records using Jinja template."""
-    from flask import request
+    """Return records using Jinja template.
+
+    Output formats listed in ``CFG_BIBFORMAT_NATIVE_FORMATS`` that have a
+    native serializer skip the Jinja collection template.
+    """
+    of, context = _format_records_context(records, of, ln, ctx)
+    serializer = get_native_serializer(of, context['records'])
+    if serializer is not None:
+        return ''.join(serializer(**context))
+    return render_template_to_string(_records_templates(of), **context)
+
+
+def iter_format_records(records, of='hb', ln=None, **ctx):
+    """Return an iterator over chunks of formatted records."""
+    from flask import current_app
+
+    of, context = _format_records_context(records, of, ln, ctx)
+    serializer = get_native_serializer(of, context['records'])
+    if serializer is not None:
+        return serializer(**context)
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_or_select_template(
+        _records_templates(of))
+    return template.generate(context)
+
+
+def format_record_async(record, of, ln=None, **kwargs):
+    """Start formatting a record in the render thread pool.
+
+    :return: :class:`multiprocessing.pool.AsyncResult` of
+        :func:`format_record`
+    """
+    from flask import copy_current_request_context
+
+    render = copy_current_request_context(
+        lambda: format_record(record, of, ln=ln, **kwargs))
+    return get_render_pool().apply_async(_in_render_pool, (render, ))
+
+
+def format_records_async(records, of='hb', ln=None, **ctx):
+    """Start formatting records in the render thread pool.
+
+    The caller is free to do other work (e.g. start rendering other pages)
+    while the records are rendered.
+
+    :return: :class:`multiprocessing.pool.AsyncResult` of
+        :func:`format_records`
+    """
+    from flask import copy_current_request_context
+
+    render = copy_current_request_context(
+        lambda: format_records(records, of=of, ln=ln, **ctx))
+    return get_render_pool().apply_async(_in_render_pool, (render, ))
+
+
+def get_native_serializer(of, records=None):
+    """Return the enabled native serializer for ``of`` or ``None``.
+
+    Records rendered by worker processes always use the templates.
+    """
+    if isinstance(records, OffloadedRecords):
+        return None
+    if of not in cfg.get('CFG_BIBFORMAT_NATIVE_FORMATS',
+                         CFG_BIBFORMAT_NATIVE_FORMATS):
+        return None
+    return native_formats.get(of)
+
+
+def is_native_xslt(of):
+    """Check if the records of ``of`` are transformed page by page.
+
+    Enabled output formats whose default format template is an XSLT
+    stylesheet are transformed by :func:`invenio_formatter.serializers.xslt`.
+    """
+    return of in cfg.get('CFG_BIBFORMAT_NATIVE_FORMATS',
+                         CFG_BIBFORMAT_NATIVE_FORMATS) and \
+        get_output_format(of).get('default', '').endswith('.xsl')
+
+
+def _records_templates(of):
+    """Return the list of candidate templates for a records collection."""
+    return ['format/records/%s.tpl' % of,
+            'format/records/%s.tpl' % of[0],
+            'format/records/%s.tpl' % get_output_format_content_type(of).
+            replace('/', '_')]
+
+
+def _format_records_context(records, of, ln, ctx):
+    """Build the rendering context shared by all records renderers."""
+    from flask import current_app, request
     from invenio.base.i18n import wash_language
     from .registry import export_formats
 
@@ -206,7 +534,15 @@ def format_records(records, of='hb', ln=None, **ctx):
     ln = ln or wash_language(request.values.get('ln', cfg['CFG_SITE_LANG']))
     ot = (request.values.get('ot', ctx.get('ot')) or '').split(',')
 
-    if jrec > records:
+    if isinstance(records, LazyRecords):
+        if jrec > len(records):
+            jrec = rg * (len(records) // rg) + 1
+        records.set_window(jrec, rg)
+        if of == 'recjson' and any(ot):
+            records.set_fields(['recid'] + [field for field in ot if field])
+        else:
+            records.set_fields(get_output_format_fields(of))
+    elif jrec > records:
         jrec = rg * (records // rg) + 1
 
     context = dict(
@@ -216,15 +552,122 @@ def format_records(records, of='hb', ln=None, **ctx):
         records=records,
         export_formats=export_formats,
         format_record=format_record,
-        **TEMPLATE_CONTEXT_FUNCTIONS_CACHE.template_context_functions
     )
     context.update(ctx)
-    return render_template_to_string(
-        ['format/records/%s.tpl' % of,
-         'format/records/%s.tpl' % of[0],
-         'format/records/%s.tpl' % get_output_format_content_type(of).
-            replace('/', '_')],
-        **context)
+    TEMPLATE_CONTEXT_FUNCTIONS_CACHE.install(current_app.jinja_env)
+    if 'format_record' not in ctx:
+        if should_offload(records, of):
+            context['records'], outputs = offload_records(records, of, ln)
+            context['format_record'] = serve_rendered(
+                outputs, of, ln, load=load_record)
+        elif is_native_xslt(of):
+            context['format_record'] = serve_rendered(
+                xslt(_page(records, rg), of), of, ln)
+        elif get_format_property(of, 'parallel'):
+            context['format_record'] = prerender_records(records, of, rg,
+                                                         ln)
+    return of, context
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_render_pool_thread = threading.local()
+
+
+def get_render_pool():
+    """Return the thread pool rendering records of a page concurrently."""
+    from multiprocessing.pool import ThreadPool
+
+    global _render_pool
+    if _render_pool is None:
+        with _render_pool_lock:
+            if _render_pool is None:
+                _render_pool = ThreadPool(cfg.get(
+                    'CFG_BIBFORMAT_RENDER_THREADS',
+                    CFG_BIBFORMAT_RENDER_THREADS))
+    return _render_pool
+
+
+def _in_render_pool(f, *args):
+    """Call ``f`` marking the current thread as a render pool thread."""
+    _render_pool_thread.active = True
+    try:
+        return f(*args)
+    finally:
+        _render_pool_thread.active = False
+
+
+def serve_rendered(rendered, page_of, page_ln, load=None):
+    """Return a ``format_record`` serving records rendered beforehand.
+
+    Calls for the records in ``rendered``, in output format ``page_of`` and
+    language ``page_ln`` for the current user, return the rendered output.
+    Calls for another format, language or user, or with other arguments
+    render the record as usual.
+
+    :param rendered: mapping of record identifiers to their output
+    :param load: function loading the record to render from the record
+        passed to ``format_record``, when it holds only its identifier
+    """
+    from flask_login import current_user
+
+    def prerendered_format_record(record, of, ln=None, verbose=0,
+                                  search_pattern=None, xml_record=None,
+                                  user_info=None, **kwargs):
+        if of == page_of and (ln or cfg['CFG_SITE_LANG']) == page_ln and \
+                not (verbose or search_pattern or xml_record or kwargs) and \
+                user_info in (None, current_user,
+                              current_user._get_current_object()) and \
+                record['recid'] in rendered:
+            return rendered[record['recid']]
+        if load is not None:
+            record = load(record)
+            if record is None:
+                return ''
+        return format_record(record, of, ln=ln, verbose=verbose,
+                             search_pattern=search_pattern,
+                             xml_record=xml_record, user_info=user_info,
+                             **kwargs)
+    return prerendered_format_record
+
+
+def _page(records, rg):
+    """Return the records of a page of at most ``rg`` records or ``[]``."""
+    if isinstance(records, LazyRecords) or \
+            (hasattr(records, '__len__') and len(records) <= rg):
+        return list(records)
+    return []
+
+
+def prerender_records(records, of, rg, ln=None):
+    """Render the records of a page concurrently in ``of``.
+
+    Only pages of at most ``rg`` records (or the window of
+    :class:`~invenio_formatter.records.LazyRecords`) are rendered.  Each
+    record is rendered in a thread of :func:`get_render_pool` with a copy of
+    the current request context.
+
+    :return: function with the signature of :func:`format_record` returning
+        the rendered records and rendering any other record as usual
+    """
+    from flask import copy_current_request_context
+
+    page = _page(records, rg)
+    ln = ln or cfg['CFG_SITE_LANG']
+
+    def render(record):
+        return format_record(record, of, ln=ln)
+
+    # tasks of the pool must not wait for other tasks of the pool
+    if len(page) > 1 and not getattr(_render_pool_thread, 'active', False):
+        tasks = [(copy_current_request_context(render), record)
+                 for record in page]
+        outputs = get_render_pool().map(
+            lambda task: _in_render_pool(task[0], task[1]), tasks)
+    else:
+        outputs = [render(record) for record in page]
+    return serve_rendered(
+        dict(zip([record['recid'] for record in page], outputs)), of, ln)
 
 
 def decide_format_template(record, of):
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Offline export of formatted records to compressed files.
+
+The records are split in contiguous shards rendered by a pool of worker
+processes.  Each shard writes gzip files closed once they reach the
+configured size and records its progress in a checkpoint after every
+closed file, so that an interrupted export resumes where it stopped.
+
+Exports are written to ``<export dir>/<of>.partial`` and moved to
+``<export dir>/<of>`` together with their ``manifest.json`` once all the
+shards are done.
+
+The ``export`` property of an output format gives the ``prologue``,
+``separator`` and ``epilogue`` wrapping the records of every file, by
+default one record per line.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from invenio.base.globals import cfg
+
+from .config import CFG_BIBFORMAT_EXPORT_DIR, CFG_BIBFORMAT_EXPORT_FILE_SIZE
+from .workers import get_worker_app, init_worker
+
+MANIFEST = 'manifest.json'
+"""Name of the manifest of an export."""
+
+
+def get_export_dir(of=None):
+    """Return the export directory, or the one of output format ``of``."""
+    directory = cfg.get('CFG_BIBFORMAT_EXPORT_DIR', CFG_BIBFORMAT_EXPORT_DIR)
+    if directory is None:
+        directory = os.path.join(cfg['CFG_CACHEDIR'], 'formatter', 'export')
+    if of is not None:
+        directory = os.path.join(directory, of.lower())
+    return directory
+
+
+def load_manifest(of):
+    """Return the manifest of the last export of ``of`` or ``None``."""
+    try:
+        with open(os.path.join(get_export_dir(of), MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _hidden_recids():
+    """Return the identifiers of restricted and deleted records."""
+    from invenio.legacy.search_engine import get_all_restricted_recids, \
+        search_pattern
+
+    return get_all_restricted_recids() | search_pattern(p='980__c:DELETED')
+
+
+def get_recids(recids=None, query=None):
+    """Return the identifiers of the records to export in ascending order.
+
+    Only public records that are not deleted are exported.
+
+    :param recids: ``(first, last)`` range of record identifiers
+    :param query: search query selecting the records
+    """
+    hidden = _hidden_recids()
+    if query is not None:
+        from invenio.legacy.search_engine import perform_request_search
+        found = perform_request_search(p=query, of='id')
+        if recids is not None:
+            found = [recid for recid in found
+                     if recids[0] <= recid <= recids[1]]
+        return sorted(recid for recid in found if recid not in hidden)
+
+    from invenio.modules.records.models import Record
+
+    ids = Record.query.order_by(Record.id)
+    if recids is not None:
+        ids = ids.filter(Record.id.between(*recids))
+    return [recid for recid, in ids.values(Record.id)
+            if recid not in hidden]
+
+
+def _write_json(path, data):
+    """Write ``data`` as JSON to ``path`` atomically."""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def _file_sha1(path):
+    """Return the SHA-1 hex digest of the content of ``path``."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ExportFile(object):
+    """Gzip file of formatted records wrapped as given by the format."""
+
+    def __init__(self, path, wrapping):
+        """Create the file and write the prologue."""
+        self.path = path
+        self.wrapping = wrapping
+        self.records = 0
+        self.first = self.last = None
+        self._raw = open(path, 'wb')
+        self._gzip = gzip.GzipFile(filename='', mode='wb', fileobj=self._raw,
+                                   mtime=0)
+        self._write(wrapping.get('prologue', ''))
+
+    def _write(self, text):
+        """Write ``text`` encoded in UTF-8."""
+        if text:
+            self._gzip.write(text.encode('utf-8'))
+
+    @property
+    def size(self):
+        """Return the number of compressed bytes written so far."""
+        return self._raw.tell()
+
+    def write(self, recid, output):
+        """Write the ``output`` of record ``recid``."""
+        if self.records:
+            self._write(self.wrapping.get('separator', '\n'))
+        self._write(output)
+        self.records += 1
+        self.first = recid if self.first is None else self.first
+        self.last = recid
+
+    def close(self):
+        """Write the epilogue, close the file and return its description."""
+        self._write(self.wrapping.get('epilogue', '\n'))
+        self._gzip.close()
+        self._raw.close()
+        return {'name': os.path.basename(self.path),
+                'records': self.records,
+                'first': self.first,
+                'last': self.last,
+                'size': os.path.getsize(self.path),
+                'sha1': _file_sha1(self.path)}
+
+
+def _shard_digest(recids):
+    """Return a digest identifying the records of a shard."""
+    return hashlib.sha1(','.join(map(str, recids)).encode('ascii')) \
+        .hexdigest()
+
+
+def export_shard(args):
+    """Export one shard, resuming from its checkpoint.
+
+    :return: the checkpoint of the finished shard
+    """
+    directory, of, ln, shard, recids, file_size, batch_size = args
+    with get_worker_app().test_request_context():
+        return _export_shard(directory, of, ln, shard, recids, file_size,
+                             batch_size)
+
+
+def _export_shard(directory, of, ln, shard, recids, file_size, batch_size):
+    """Export records ``recids`` as shard number ``shard``."""
+    from .api import get_format_property, get_output_format_content_type, \
+        get_output_format_fields
+    from .engine import format_record
+    from .records import get_records_loader
+
+    prefix = '{0}-{1:03d}-'.format(of, shard)
+    extension = (mimetypes.guess_extension(
+        get_output_format_content_type(of)) or '.txt') + '.gz'
+    wrapping = get_format_property(of, 'export') or {}
+    checkpoint_path = os.path.join(directory, prefix + 'checkpoint.json')
+    digest = _shard_digest(recids)
+
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (IOError, ValueError):
+        checkpoint = None
+    if checkpoint is None or checkpoint['recids'] != digest:
+        checkpoint = {'shard': shard, 'recids': digest, 'position': 0,
+                      'files': [], 'done': False}
+
+    # remove the file being written when the export was interrupted
+    kept = set(item['name'] for item in checkpoint['files'])
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(extension) \
+                and name not in kept:
+            os.remove(os.path.join(directory, name))
+    if checkpoint['done']:
+        return checkpoint
+
+    loader = get_records_loader()
+    fields = get_output_format_fields(of)
+    position = checkpoint['position']
+    output = None
+    while position < len(recids):
+        batch = recids[position:position + batch_size]
+        for recid, record in zip(batch, loader(batch, fields=fields)):
+            position += 1
+            if record is None:
+                continue
+            if output is None:
+                name = '{0}{1:05d}{2}'.format(
+                    prefix, len(checkpoint['files']), extension)
+                output = ExportFile(os.path.join(directory, name), wrapping)
+            output.write(recid, format_record(record, of, ln=ln))
+            if output.size >= file_size:
+                checkpoint['files'].append(output.close())
+                checkpoint['position'] = position
+                _write_json(checkpoint_path, checkpoint)
+                output = None
+
+    if output is not None:
+        checkpoint['files'].append(output.close())
+    checkpoint['position'] = position
+    checkpoint['done'] = True
+    _write_json(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+def export(of, recids, processes=4, file_size=None, batch_size=100,
+           ln=None, resume=True, callback=None):
+    """Export records ``recids`` formatted in ``of`` to compressed files.
+
+    :param recids: ordered list of record identifiers
+    :param processes: number of shards rendered in parallel
+    :param file_size: compressed size after which a file is closed
+    :param resume: reuse checkpoints of an interrupted export
+    :param callback: called with the checkpoint of every finished shard
+    :return: the manifest of the export
+    """
+    from multiprocessing import Pool
+
+    from .api import get_output_format_content_type
+
+    of = of.lower()
+    ln = ln or cfg['CFG_SITE_LANG']
+    file_size = file_size or cfg.get('CFG_BIBFORMAT_EXPORT_FILE_SIZE',
+                                     CFG_BIBFORMAT_EXPORT_FILE_SIZE)
+    target = get_export_dir(of)
+    directory = target + '.partial'
+    if not resume and os.path.isdir(directory):
+        shutil.rmtree(directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    shard_size = -(-len(recids) // processes) or 1
+    shards = [(directory, of, ln, shard, recids[start:start + shard_size],
+               file_size, batch_size)
+              for shard, start in enumerate(
+                  range(0, len(recids), shard_size))]
+
+    # remove shards of an interrupted export run with more processes
+    prefixes = tuple('{0}-{1:03d}-'.format(of, shard[3]) for shard in shards)
+    for name in os.listdir(directory):
+        if not name.startswith(prefixes):
+            os.remove(os.path.join(directory, name))
+
+    checkpoints = []
+    pool = Pool(processes, initializer=init_worker)
+    try:
+        for checkpoint in pool.imap_unordered(export_shard, shards):
+            checkpoints.append(checkpoint)
+            if callback is not None:
+                callback(checkpoint)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    checkpoints.sort(key=lambda checkpoint: checkpoint['shard'])
+    files = [item for checkpoint in checkpoints
+             for item in checkpoint['files']]
+    manifest = {'format': of,
+                'content_type': get_output_format_content_type(of),
+                'created': datetime.datetime.utcnow().strftime(
+                    '%Y-%m-%dT%H:%M:%SZ'),
+                'records': sum(item['records'] for item in files),
+                'size': sum(item['size'] for item in files),
+                'files': files}
+    for name in os.listdir(directory):
+        if name.endswith('checkpoint.json'):
+            os.remove(os.path.join(directory, name))
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+
+    # replace the previous export, removing the one an interrupted
+    # replacement left behind
+    shutil.rmtree(target + '.old', ignore_errors=True)
+    if os.path.isdir(target):
+        os.rename(target, target + '.old')
+    os.rename(directory, target)
+    shutil.rmtree(target + '.old', ignore_errors=True)
+    return manifest
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Jinja extensions for format templates."""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from markupsafe import Markup
+
+
+class FragmentCacheExtension(Extension):
+    """Cache the output of a template block.
+
+    .. code-block:: jinja
+
+        {% bfcache 'record_info:%s' % recid, 3600 %}
+          ...
+        {% endbfcache %}
+
+    The key should identify everything the block depends on besides the
+    language, which is added to it.  The timeout in seconds is optional.
+    Fragments are invalidated together with the cached formats.
+    """
+
+    tags = set(['bfcache'])
+
+    def parse(self, parser):
+        """Parse the ``bfcache`` tag."""
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endbfcache'],
+                                       drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, timeout, caller):
+        """Return the cached fragment or render and cache it."""
+        from flask import g
+        from invenio.base.globals import cfg
+        from .cache import fragment_key, get_fragment, set_fragment
+
+        key = fragment_key(key, getattr(g, 'ln', None) or
+                           cfg['CFG_SITE_LANG'])
+        out = get_fragment(key)
+        if out is None:
+            out = caller()
+            set_fragment(key, out, timeout)
+        return Markup(out)
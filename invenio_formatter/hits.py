@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Compact server-side storage of the last search hits.
+
+Only a key is kept in the session; the hits are stored in the shared cache
+together with an index that finds the position of a record in logarithmic
+time.
+"""
+
+import uuid
+from array import array
+from bisect import bisect_left
+
+from .config import CFG_BIBFORMAT_HITS_CACHE_TIMEOUT
+
+SESSION_KEY = 'websearch-last-query-hits-key'
+"""Session key holding the cache key of the last search hits."""
+
+LEGACY_SESSION_KEY = 'websearch-last-query-hits'
+"""Session key under which the search stores the whole list of hits."""
+
+
+def _array(data=()):
+    """Return an array of unsigned integers initialized from ``data``."""
+    out = array('I')
+    if isinstance(data, bytes):
+        if hasattr(out, 'frombytes'):
+            out.frombytes(data)
+        else:  # pragma: no cover
+            out.fromstring(data)
+    else:
+        out.extend(data)
+    return out
+
+
+def _bytes(data):
+    """Return the machine representation of an array."""
+    if hasattr(data, 'tobytes'):
+        return data.tobytes()
+    return data.tostring()  # pragma: no cover
+
+
+class HitList(object):
+    """Ordered list of record identifiers with position lookup.
+
+    It behaves like the list of hits for ``len()``, indexing, ``in`` and
+    ``index()``, which is all the back-to-search links need.
+    """
+
+    def __init__(self, recids, _index=None):
+        """Initialize the hit list in search result order."""
+        self.recids = _array(recids)
+        if _index is None:
+            positions = sorted(range(len(self.recids)),
+                               key=self.recids.__getitem__)
+            _index = (_array(self.recids[i] for i in positions),
+                      _array(positions))
+        self._sorted, self._positions = _index
+
+    def __len__(self):
+        """Return the number of hits."""
+        return len(self.recids)
+
+    def __getitem__(self, position):
+        """Return the record identifier at ``position``."""
+        return self.recids[position]
+
+    def __iter__(self):
+        """Iterate over record identifiers in search result order."""
+        return iter(self.recids)
+
+    def __contains__(self, recid):
+        """Check if ``recid`` is one of the hits."""
+        try:
+            self.index(recid)
+        except ValueError:
+            return False
+        return True
+
+    def index(self, recid):
+        """Return the position of ``recid`` in the hits."""
+        i = bisect_left(self._sorted, recid)
+        if i == len(self._sorted) or self._sorted[i] != recid:
+            raise ValueError('{0} is not in hits'.format(recid))
+        return self._positions[i]
+
+    def neighbours(self, recid):
+        """Return previous and next record identifiers around ``recid``."""
+        position = self.index(recid)
+        previous = self.recids[position - 1] if position > 0 else None
+        next_ = self.recids[position + 1] \
+            if position + 1 < len(self.recids) else None
+        return previous, next_
+
+    def dumps(self):
+        """Serialize the hit list and its index."""
+        return (_bytes(self.recids), _bytes(self._sorted),
+                _bytes(self._positions))
+
+    @classmethod
+    def loads(cls, data):
+        """Create a hit list from the output of :meth:`dumps`."""
+        recids, sorted_, positions = data
+        return cls(recids, _index=(_array(sorted_), _array(positions)))
+
+
+def _cache_key(key):
+    """Return the shared cache key for the hits stored under ``key``."""
+    return 'formatter::hits::{0}'.format(key)
+
+
+def store_hits(recids, timeout=None):
+    """Store hits of the last search and remember the key in the session."""
+    from flask import session
+    from invenio.base.globals import cfg
+    from invenio.ext.cache import cache
+
+    key = uuid.uuid4().hex
+    cache.set(_cache_key(key), HitList(recids).dumps(),
+              timeout=timeout or cfg.get('CFG_BIBFORMAT_HITS_CACHE_TIMEOUT',
+                                         CFG_BIBFORMAT_HITS_CACHE_TIMEOUT))
+    session[SESSION_KEY] = key
+    return key
+
+
+def load_hits():
+    """Return the hits of the last search or ``None``."""
+    from flask import session
+    from invenio.ext.cache import cache
+
+    key = session.get(SESSION_KEY)
+    if key is None:
+        return None
+    data = cache.get(_cache_key(key))
+    if data is None:
+        return None
+    return HitList.loads(data)
+
+
+def move_session_hits():
+    """Move the hits stored in the session by the search to the cache.
+
+    The search keeps the list of hits in the session; it is replaced by a
+    key so that the session cookie does not grow with the hits.
+    """
+    from flask import session
+
+    if LEGACY_SESSION_KEY not in session:
+        return None
+    recids = session.pop(LEGACY_SESSION_KEY)
+    if not recids:
+        session.pop(SESSION_KEY, None)
+        return None
+    return store_hits(recids)
@@ -35,20 +35,84 @@ manager = Manager(usage=__doc__)
 @manager.option('-o', '--output-format', dest='output_format',
                 default="HB", help="Specify output format/s (default HB)")
 def expunge(output_format="HB"):
-    """Remove static output formats from cache."""
-    from invenio.ext.sqlalchemy import db
-    from .models import Bibfmt
+    """Invalidate static output formats in cache."""
+    from .cache import invalidate
 
     # Make it uppercased as it is stored in database.
     output_format = output_format.upper()
-    print(">>> Cleaning %s cache..." % (output_format, ))
-    # Prepare where expression.
-    filter_format = (
-        Bibfmt.format == output_format if ',' not in output_format else
-        Bibfmt.format.in_(map(lambda x: x.strip(), output_format.split(',')))
-    )
-    Bibfmt.query.filter(filter_format).delete(synchronize_session=False)
-    db.session.commit()
+    for code in map(lambda x: x.strip(), output_format.split(',')):
+        print(">>> Invalidating %s cache (generation %d)..." % (
+            code, invalidate(code)))
+    print(">>> Obsolete rows are being purged in the background.")
+
+
+@manager.option('-o', '--output-format', dest='output_format',
+                default="HB", help="Specify output format/s (default HB)")
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=None, help="Number of records per chunk")
+@manager.option('-t', '--throttle', dest='throttle', type=float,
+                default=0.1, help="Seconds to sleep between chunks")
+def purge(output_format="HB", chunk_size=None, throttle=0.1):
+    """Remove invalidated output formats from cache in chunks."""
+    from .cache import purge as purge_cache, purge_blobs
+
+    # Make it uppercased as it is stored in database.
+    output_format = output_format.upper()
+    for code in map(lambda x: x.strip(), output_format.split(',')):
+        print(">>> Purging %s cache..." % (code, ))
+        print(">>> Removed %d rows." % (
+            purge_cache(code, chunk_size=chunk_size, throttle=throttle), ))
+    print(">>> Removed %d unused blobs." % (purge_blobs(), ))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=100, help="Number of records read per batch")
+def refresh(batch_size=100):
+    """Render again stale output formats queued in the refresh table."""
+    from .refresh import process_refresh_table
+
+    print(">>> Refreshing queued records...")
+    print(">>> Refreshed %d records." % (
+        process_refresh_table(batch_size=batch_size), ))
+
+
+@manager.option('-o', '--output-format', dest='output_format',
+                default="XM", help="Specify output format (default XM)")
+@manager.option('-r', '--recids', dest='recids', default=None,
+                help="Range of record identifiers (e.g. 1-1000)")
+@manager.option('-q', '--query', dest='query', default=None,
+                help="Search query selecting the records")
+@manager.option('-p', '--processes', dest='processes', type=int,
+                default=4, help="Number of worker processes")
+@manager.option('-s', '--file-size', dest='file_size', type=int,
+                default=None, help="Compressed size of the files in bytes")
+@manager.option('--no-resume', dest='resume', action='store_false',
+                default=True, help="Start again an interrupted export")
+def export(output_format="XM", recids=None, query=None, processes=4,
+           file_size=None, resume=True):
+    """Export formatted records to compressed files with a manifest."""
+    from .export import export as export_records, get_export_dir, \
+        get_recids
+
+    if recids is not None:
+        first, dummy, last = recids.partition('-')
+        recids = (int(first), int(last or first))
+    of = output_format.lower()
+
+    print(">>> Searching records...")
+    recids = get_recids(recids=recids, query=query)
+    print(">>> Exporting %d records in %s to %s..." % (
+        len(recids), of, get_export_dir(of)))
+
+    def progress(checkpoint):
+        print(">>> Shard %d done (%d files)." % (
+            checkpoint['shard'], len(checkpoint['files'])))
+
+    manifest = export_records(of, recids, processes=processes,
+                              file_size=file_size, resume=resume,
+                              callback=progress)
+    print(">>> Exported %d records in %d files." % (
+        manifest['records'], len(manifest['files'])))
 
 
 def main():
@@ -26,6 +26,10 @@ class Bibfmt(db.Model):
     """Represent a Bibfmt record."""
 
     __tablename__ = 'bibfmt'
+    __table_args__ = (
+        db.Index('ix_bibfmt_format_last_updated', 'format', 'last_updated'),
+        db.Index('ix_bibfmt_kind_format', 'kind', 'format'),
+    )
 
     id_bibrec = db.Column(
         db.MediumInteger(8, unsigned=True),
@@ -44,9 +48,9 @@ class Bibfmt(db.Model):
     kind = db.Column(
         db.String(10),
         nullable=False,
-        server_default='',
-        index=True
+        server_default=''
     )
+    """Kind of rendering, indexed together with the format."""
 
     last_updated = db.Column(
         db.DateTime,
@@ -54,8 +58,73 @@ class Bibfmt(db.Model):
         server_default='1900-01-01 00:00:00',
         index=True)
 
-    value = db.Column(db.iLargeBinary)
+    value = db.deferred(db.Column(db.iLargeBinary))
+    """Cached rendering, loaded only when accessed."""
+
+    encoding = db.Column(db.String(10), nullable=False, server_default='')
+    """Content encoding of value (e.g. gzip), empty if not compressed.
+
+    Prefixed with ``blob:`` when value is the digest of the encoded
+    rendering in the blob store.
+    """
 
     needs_2nd_pass = db.Column(db.TinyInteger(1), server_default='0')
 
-__all__ = ('Bibfmt', )
+    generation = db.Column(
+        db.Integer(15, unsigned=True),
+        nullable=False,
+        server_default='0')
+    """Generation of the output format when the rendering started."""
+
+
+class BibfmtGeneration(db.Model):
+    """Represent the cache generation of an output format.
+
+    Cached formats of an older generation than their output format are
+    treated as missing until they are purged.
+    """
+
+    __tablename__ = 'bibfmt_generation'
+
+    format = db.Column(
+        db.String(10),
+        nullable=False,
+        server_default='',
+        primary_key=True)
+
+    generation = db.Column(
+        db.Integer(15, unsigned=True),
+        nullable=False,
+        server_default='0')
+
+    invalidated = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default='1900-01-01 00:00:00')
+
+
+class BibfmtRefresh(db.Model):
+    """Represent a stale cached format queued for refresh."""
+
+    __tablename__ = 'bibfmt_refresh'
+
+    id_bibrec = db.Column(
+        db.MediumInteger(8, unsigned=True),
+        nullable=False,
+        server_default='0',
+        primary_key=True,
+        autoincrement=False)
+
+    format = db.Column(
+        db.String(10),
+        nullable=False,
+        server_default='',
+        primary_key=True)
+
+    queued = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default='1900-01-01 00:00:00',
+        index=True)
+
+__all__ = ('Bibfmt', 'BibfmtGeneration', 'BibfmtRefresh')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Render large exports in a pool of worker processes.
+
+Record identifiers are sent in chunks to processes holding their own
+application, which load and render the records.  The collection template
+is still rendered by the web process, its ``format_record`` returning the
+outputs of the workers in order as they arrive.
+
+Workers render records as an anonymous user, so only exports of guests
+are offloaded.  The pool is started with the application when
+``CFG_BIBFORMAT_OFFLOAD_PROCESSES`` is set; servers forking the
+application after it is loaded must load it in every worker instead
+(e.g. ``lazy-apps`` of uWSGI) so that each one starts its own pool.
+"""
+
+from invenio.base.globals import cfg
+
+from .config import CFG_BIBFORMAT_OFFLOAD_CHUNK_SIZE, \
+    CFG_BIBFORMAT_OFFLOAD_MIN_RECORDS
+from .records import LazyRecords
+from .workers import get_worker_app, in_worker, init_worker
+
+_pool = None
+"""Pool of worker processes started with the application."""
+
+
+def _render_chunk(args):
+    """Load and render a chunk of records in a worker process.
+
+    :return: list of ``(recid, output)`` pairs, the output being ``None``
+        for records that cannot be loaded
+    """
+    from .api import get_output_format_fields
+    from .engine import format_record
+    from .records import get_records_loader
+
+    recids, of, ln = args
+    with get_worker_app().test_request_context():
+        records = get_records_loader()(
+            recids, fields=get_output_format_fields(of))
+        return [(recid, format_record(record, of, ln=ln)
+                 if record is not None else None)
+                for recid, record in zip(recids, records)]
+
+
+def start_offload_pool(processes):
+    """Start the pool of ``processes`` worker processes.
+
+    Nothing is started in the worker processes themselves.
+    """
+    from multiprocessing import Pool
+
+    global _pool
+    if _pool is None and processes and not in_worker():
+        _pool = Pool(processes, initializer=init_worker)
+    return _pool
+
+
+def get_offload_pool():
+    """Return the pool of worker processes or ``None`` if not started."""
+    return _pool
+
+
+class OffloadedRecords(list):
+    """Records of an offloaded export, holding only their identifiers."""
+
+
+class OffloadedOutputs(object):
+    """Outputs of the workers by record identifier, read as they arrive."""
+
+    def __init__(self, results):
+        """Initialize with the ordered iterator of rendered chunks."""
+        self._results = results
+        self._buffer = {}
+
+    def __contains__(self, recid):
+        """Check if a worker rendered ``recid``.
+
+        Outputs are read until the one of ``recid``; records the workers
+        could not load or did not render are missing.
+        """
+        while recid not in self._buffer:
+            try:
+                self._buffer.update(next(self._results))
+            except StopIteration:
+                return False
+        if self._buffer[recid] is None:
+            del self._buffer[recid]
+            return False
+        return True
+
+    def __getitem__(self, recid):
+        """Return the output of ``recid`` rendered by a worker."""
+        if recid not in self:
+            raise KeyError(recid)
+        return self._buffer.pop(recid)
+
+
+def load_record(record):
+    """Load the whole record of an offloaded ``record`` or ``None``."""
+    from .records import get_records_loader
+
+    return get_records_loader()([record['recid']], fields=None)[0]
+
+
+def should_offload(records, of):
+    """Check if rendering ``records`` in ``of`` is offloaded to workers."""
+    from flask_login import current_user
+    from .api import get_format_property
+
+    if get_offload_pool() is None or not current_user.is_guest:
+        return False
+    if not get_format_property(of, 'offload'):
+        return False
+    if isinstance(records, LazyRecords):
+        size = len(records.window_recids())
+    elif hasattr(records, '__len__'):
+        size = len(records)
+    else:
+        return False
+    return size >= cfg.get('CFG_BIBFORMAT_OFFLOAD_MIN_RECORDS',
+                           CFG_BIBFORMAT_OFFLOAD_MIN_RECORDS)
+
+
+def offload_records(records, of, ln):
+    """Send ``records`` to the worker processes to be rendered in ``of``.
+
+    :return: tuple of the :class:`OffloadedRecords` to pass to the template
+        and the matching :class:`OffloadedOutputs`; records missing from the
+        outputs are loaded with :func:`load_record` and rendered locally
+    """
+    if isinstance(records, LazyRecords):
+        recids = records.window_recids()
+    else:
+        recids = [record['recid'] for record in records]
+
+    chunk_size = cfg.get('CFG_BIBFORMAT_OFFLOAD_CHUNK_SIZE',
+                         CFG_BIBFORMAT_OFFLOAD_CHUNK_SIZE)
+    chunks = [(recids[i:i + chunk_size], of, ln)
+              for i in range(0, len(recids), chunk_size)]
+    results = get_offload_pool().imap(_render_chunk, chunks)
+    return (OffloadedRecords({'recid': recid} for recid in recids),
+            OffloadedOutputs(results))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Lazy sequence of records for paginated formatting."""
+
+from itertools import islice
+
+from six import string_types
+
+from werkzeug.utils import import_string
+
+from .config import CFG_BIBFORMAT_RECORDS_LOADER
+
+
+def load_records(recids, fields=None):
+    """Load records given by ``recids`` in the same order.
+
+    :param recids: list of record identifiers
+    :param fields: top-level fields that will be formatted or ``None`` for
+        the whole record; loaders able to fetch partial records use it to
+        skip the other fields
+    """
+    from invenio.modules.records.api import Record, get_record
+
+    recids = list(recids)
+    found = {}
+    if recids:
+        for json in Record.storage_engine.get_many(recids):
+            found[json.get('recid', json.get('_id'))] = json
+
+    records = []
+    for recid in recids:
+        json = found.get(recid)
+        if json is None:
+            # records missing from the storage are created by get_record
+            records.append(get_record(recid))
+            continue
+        if fields is not None:
+            json = _project(json, fields)
+        records.append(Record(json))
+    return records
+
+
+KEPT_FIELDS = frozenset(['recid', 'modification_date'])
+"""Fields kept by the projection of records on the formatted fields.
+
+The modification date tells if a cached rendering of the record is stale.
+"""
+
+
+def _project(json, fields):
+    """Keep only the top-level ``fields`` and the bookkeeping keys."""
+    fields = KEPT_FIELDS.union(fields)
+    return dict((key, value) for key, value in json.items()
+                if key in fields or key.startswith('_'))
+
+
+def get_records_loader():
+    """Return the configured records loader."""
+    from invenio.base.globals import cfg
+
+    loader = cfg.get('CFG_BIBFORMAT_RECORDS_LOADER',
+                     CFG_BIBFORMAT_RECORDS_LOADER)
+    if isinstance(loader, string_types):
+        loader = import_string(loader)
+    return loader
+
+
+class LazyRecords(object):
+    """Search hits whose records are loaded only for the current window.
+
+    :func:`~invenio_formatter.engine.format_records` sets the window from
+    ``jrec`` and ``rg``.  ``len()`` returns the number of hits without
+    loading any record and iteration yields the records of the window,
+    which are fetched with a single call to the records loader.
+
+    ``fields`` restricts the loaded records to the given top-level fields;
+    it is set from the ``ot`` parameter or from the fields used by the
+    output format.
+    """
+
+    def __init__(self, recids, loader=None, fields=None):
+        """Initialize the sequence with hits in search result order."""
+        self.recids = recids
+        self.loader = loader
+        self.fields = fields
+        self.start = 0
+        self.stop = None
+        self._records = None
+
+    def __len__(self):
+        """Return the number of hits."""
+        return len(self.recids)
+
+    def __iter__(self):
+        """Iterate over the records of the current window."""
+        if self._records is None:
+            loader = self.loader or get_records_loader()
+            self._records = loader(self.window_recids(), fields=self.fields)
+        return iter(self._records)
+
+    def set_window(self, jrec, rg):
+        """Restrict the loaded records to ``rg`` hits starting at ``jrec``."""
+        start = max(jrec - 1, 0)
+        stop = start + rg
+        if (start, stop) != (self.start, self.stop):
+            self.start, self.stop = start, stop
+            self._records = None
+
+    def set_fields(self, fields):
+        """Restrict the loaded records to ``fields``."""
+        fields = frozenset(fields) if fields is not None else None
+        if fields != self.fields:
+            self.fields = fields
+            self._records = None
+
+    def window_recids(self):
+        """Return record identifiers of the current window."""
+        try:
+            return list(self.recids[self.start:self.stop])
+        except TypeError:
+            return list(islice(self.recids, self.start, self.stop))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Refresh stale cached formats in the background.
+
+Stale renderings served by :func:`~invenio_formatter.engine.format_record`
+are queued for re-rendering either in an in-process queue consumed by
+worker threads, or in the ``bibfmt_refresh`` table consumed by the
+``refresh`` command of the formatter manager.
+"""
+
+import datetime
+import threading
+
+from invenio.base.globals import cfg
+
+from six.moves import queue
+
+from .config import CFG_BIBFORMAT_REFRESH_BACKEND, \
+    CFG_BIBFORMAT_REFRESH_QUEUE_SIZE, CFG_BIBFORMAT_REFRESH_WORKERS
+
+
+def refresh_records(recids, of):
+    """Render records ``recids`` in format ``of`` and store them in the cache.
+
+    The records are loaded together and their renderings are written with
+    :func:`~invenio_formatter.cache.bulk_set_cached_values`.
+
+    :return: number of stored renderings
+    """
+    from flask import current_app
+    from .cache import bulk_set_cached_values, get_generation
+    from .engine import render_first_pass
+    from .records import get_records_loader
+
+    generation = get_generation(of)
+    rows = []
+    for recid, record in zip(recids,
+                             get_records_loader()(recids, fields=None)):
+        if record is None:
+            continue
+        started = datetime.datetime.now()
+        try:
+            out, needs_2nd_pass, cacheable = render_first_pass(record, of)
+        except Exception:
+            current_app.logger.exception(
+                'Failed to refresh %s in format %s', recid, of)
+            continue
+        if not cacheable:
+            continue
+        rows.append((recid, of, '', out, started, needs_2nd_pass,
+                     generation))
+    return bulk_set_cached_values(rows)
+
+
+def refresh_record(recid, of):
+    """Render record ``recid`` in format ``of`` and store it in the cache."""
+    refresh_records([recid], of)
+
+
+class RefreshQueue(object):
+    """Bounded queue of records to refresh consumed by worker threads.
+
+    A record already waiting in the queue is not queued again, and records
+    are dropped when the queue is full.
+    """
+
+    def __init__(self, workers, maxsize):
+        """Initialize the queue; worker threads start on the first put."""
+        self.workers = workers
+        self._queue = queue.Queue(maxsize)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def put(self, app, recid, of):
+        """Queue record ``recid`` in format ``of``.
+
+        :return: ``True`` if the record was queued
+        """
+        key = (recid, of.lower())
+        with self._lock:
+            if key in self._pending:
+                return False
+            try:
+                self._queue.put_nowait((app, key))
+            except queue.Full:
+                return False
+            self._pending.add(key)
+            if not self._threads:
+                self._start()
+        return True
+
+    def _start(self):
+        """Start the worker threads."""
+        for dummy in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name='formatter-refresh')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        """Refresh queued records forever."""
+        while True:
+            app, key = self._queue.get()
+            try:
+                with app.test_request_context():
+                    refresh_record(*key)
+            except Exception:
+                app.logger.exception('Failed to refresh %s in format %s',
+                                     *key)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+
+_refresh_queue = None
+_refresh_queue_lock = threading.Lock()
+
+
+def get_refresh_queue():
+    """Return the in-process refresh queue."""
+    global _refresh_queue
+    if _refresh_queue is None:
+        with _refresh_queue_lock:
+            if _refresh_queue is None:
+                _refresh_queue = RefreshQueue(
+                    cfg.get('CFG_BIBFORMAT_REFRESH_WORKERS',
+                            CFG_BIBFORMAT_REFRESH_WORKERS),
+                    cfg.get('CFG_BIBFORMAT_REFRESH_QUEUE_SIZE',
+                            CFG_BIBFORMAT_REFRESH_QUEUE_SIZE))
+    return _refresh_queue
+
+
+def enqueue_refresh(recid, of):
+    """Queue record ``recid`` to be rendered again in format ``of``."""
+    from flask import current_app
+
+    backend = cfg.get('CFG_BIBFORMAT_REFRESH_BACKEND',
+                      CFG_BIBFORMAT_REFRESH_BACKEND)
+    if backend == 'table':
+        from sqlalchemy.orm import Session
+        from invenio.ext.sqlalchemy import db
+        from .models import BibfmtRefresh
+
+        # queue in a separate session, the request may be in a transaction
+        session = Session(bind=db.engine)
+        try:
+            session.merge(BibfmtRefresh(
+                id_bibrec=recid, format=of.upper(),
+                queued=datetime.datetime.now()))
+            session.commit()
+        finally:
+            session.close()
+        return True
+    return get_refresh_queue().put(current_app._get_current_object(),
+                                   recid, of)
+
+
+def process_refresh_table(batch_size=100):
+    """Refresh records queued in the ``bibfmt_refresh`` table.
+
+    :return: number of refreshed records
+    """
+    from flask import current_app
+    from invenio.ext.sqlalchemy import db
+    from .models import BibfmtRefresh
+
+    count = 0
+    while True:
+        batch = [(row.id_bibrec, row.format, row.queued)
+                 for row in BibfmtRefresh.query.order_by(
+                     BibfmtRefresh.queued).limit(batch_size)]
+        db.session.commit()
+        if not batch:
+            return count
+        formats = {}
+        for recid, of, dummy in batch:
+            formats.setdefault(of, []).append(recid)
+        for of, recids in formats.items():
+            try:
+                with current_app.test_request_context():
+                    refresh_records(recids, of.lower())
+            except Exception:
+                current_app.logger.exception(
+                    'Failed to refresh %d records in format %s',
+                    len(recids), of)
+        # keep records queued again while they were rendered
+        for recid, of, queued in batch:
+            BibfmtRefresh.query.filter_by(
+                id_bibrec=recid, format=of, queued=queued
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        count += len(batch)
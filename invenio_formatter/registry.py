@@ -20,6 +20,7 @@
 """Implement registries for formatter."""
 
 import os
+import re
 
 from flask_registry import (
     ModuleAutoDiscoveryRegistry,
@@ -111,3 +112,108 @@ export_formats = LazyDict(lambda: dict(
     (code, of) for code, of in output_formats.items()
     if of.get('content_type', '') != 'text/html' and of.get('visibility', 0)
 ))
+
+
+def _walk(node, parents=()):
+    """Yield AST nodes with the tuple of their parents."""
+    yield node, parents
+    for child in node.iter_child_nodes():
+        for item in _walk(child, parents + (node, )):
+            yield item
+
+
+def _field_name(path):
+    """Return the top-level field of a record field path."""
+    return re.split(r'[.\[]', path, 1)[0]
+
+
+def _template_fields(env, names, seen):
+    """Return fields of ``record`` accessed by the first existing template.
+
+    Return ``None`` when the template does not exist or uses the record in
+    a way that cannot be analysed (e.g. passes it to a function).
+    """
+    from jinja2 import TemplateNotFound, nodes
+
+    for name in names:
+        if name in seen:
+            return set()
+        try:
+            source = env.loader.get_source(env, name)[0]
+        except TemplateNotFound:
+            continue
+        seen.add(name)
+        break
+    else:
+        return None
+
+    fields = set()
+    for node, parents in _walk(env.parse(source)):
+        if isinstance(node, (nodes.Extends, nodes.Include, nodes.Import,
+                             nodes.FromImport)):
+            if not isinstance(node.template, nodes.Const):
+                return None
+            included = _template_fields(env, [node.template.value], seen)
+            if included is None:
+                return None
+            fields |= included
+        elif isinstance(node, nodes.Name) and node.name == 'record' and \
+                node.ctx == 'load':
+            parent = parents[-1]
+            if isinstance(parent, nodes.Getitem) and \
+                    isinstance(parent.arg, nodes.Const):
+                fields.add(_field_name(parent.arg.value))
+            elif isinstance(parent, nodes.Getattr) and \
+                    parent.attr == 'get' and \
+                    isinstance(parents[-2], nodes.Call) and \
+                    parents[-2].node is parent and parents[-2].args and \
+                    isinstance(parents[-2].args[0], nodes.Const):
+                fields.add(_field_name(parents[-2].args[0].value))
+            elif isinstance(parent, nodes.Getattr) and not (
+                    isinstance(parents[-2], nodes.Call) and
+                    parents[-2].node is parent):
+                # ``record.title`` looks up the field like ``record['title']``
+                fields.add(_field_name(parent.attr))
+            else:
+                return None
+    return fields
+
+
+def create_output_formats_fields_lookup():
+    """Create lookup of record fields used by output formats.
+
+    The fields are taken from the ``fields`` property of the output format
+    when present.  Otherwise they are inferred from the rules and from the
+    Jinja templates of the output format.  ``None`` means that the whole
+    record is needed.  The fields always include
+    :data:`~invenio_formatter.records.KEPT_FIELDS`.
+    """
+    from flask import current_app
+    from .records import KEPT_FIELDS
+
+    env = current_app.jinja_env
+    out = {}
+    for code, of in output_formats.items():
+        if 'fields' in of:
+            out[code] = KEPT_FIELDS.union(of['fields'] or ())
+            continue
+        fields = set(KEPT_FIELDS)
+        fields.update(_field_name(rule['field'])
+                      for rule in of.get('rules', []))
+        templates = [rule['template'] for rule in of.get('rules', [])]
+        if 'default' in of:
+            templates.append(of['default'])
+        for template in templates:
+            if not template.endswith('.tpl'):
+                fields = None
+                break
+            template_fields = _template_fields(
+                env, ['format/record/{0}'.format(template), template], set())
+            if template_fields is None:
+                fields = None
+                break
+            fields |= template_fields
+        out[code] = frozenset(fields) if fields is not None else None
+    return out
+
+output_formats_fields = LazyDict(create_output_formats_fields_lookup)
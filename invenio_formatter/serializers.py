@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Native serializers for high-volume output formats.
+
+The serializers produce the same documents as the corresponding
+``format/records/<of>.tpl`` templates without going through Jinja for the
+collection wrapper.  Each serializer is a generator of text chunks, so the
+output can either be joined into a single string or streamed.
+"""
+
+from six import iteritems
+
+from .config import CFG_BIBFORMAT_HIDDEN_TAGS
+
+native_formats = {}
+"""Mapping of output format codes to native serializers."""
+
+CHUNK_SIZE = 64 * 1024
+"""Approximate size of the chunks yielded by the serializers."""
+
+
+def native_format(code):
+    """Register the decorated generator as serializer for ``code``."""
+    def decorator(f):
+        native_formats[code] = f
+        return f
+    return decorator
+
+
+def json_dumps(obj):
+    """Serialize ``obj`` to JSON exactly like the ``tojson`` filter.
+
+    The application encoder, separators and HTML escaping of the filter are
+    kept.
+    """
+    from flask.json import htmlsafe_dumps
+    return htmlsafe_dumps(obj)
+
+
+def buffered(chunks, size=CHUNK_SIZE):
+    """Merge small text chunks into chunks of approximately ``size``."""
+    buf = []
+    length = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buf)
+            buf = []
+            length = 0
+    if buf:
+        yield ''.join(buf)
+
+
+@native_format('recjson')
+def recjson(records, ot=None, **context):
+    """Serialize records as a JSON array (see ``records/recjson.tpl``)."""
+    def chunks():
+        yield '['
+        sep = ''
+        for record in records:
+            yield sep
+            yield json_dumps(record.dumps(clean=True, keywords=ot,
+                                          filter_hidden=True))
+            sep = ', '
+        yield ']'
+    return buffered(chunks())
+
+
+def _hidden_tags(user_info):
+    """Return the MARC tags that ``user_info`` is not allowed to see."""
+    from invenio.base.globals import cfg
+
+    if user_info.get('precached_canseehiddenmarctags', False):
+        return ()
+    return frozenset(str(tag) for tag in cfg.get(
+        'CFG_BIBFORMAT_HIDDEN_TAGS', CFG_BIBFORMAT_HIDDEN_TAGS))
+
+
+def marcxml_record(record, hidden_tags=()):
+    """Yield the MARCXML ``<record>`` element of ``record`` in chunks.
+
+    The output mirrors :func:`invenio.legacy.bibrecord.record_xml_output`,
+    which is used by the ``xm`` format template.
+    """
+    from invenio.legacy.bibrecord import field_xml_output, \
+        record_order_fields
+
+    fields = [(tag, field)
+              for tag, tag_fields in iteritems(
+                  record.legacy_create_recstruct())
+              if tag[:3] not in hidden_tags
+              for field in tag_fields]
+    record_order_fields(fields)
+
+    yield '<record>'
+    for tag, field in fields:
+        yield '\n'
+        yield field_xml_output(field, tag)
+    yield '\n</record>'
+
+
+@native_format('xm')
+def marcxml(records, user_info=None, **context):
+    """Serialize records as a MARCXML collection (see ``records/xm.tpl``)."""
+    from flask_login import current_user
+
+    hidden_tags = _hidden_tags(user_info or current_user)
+
+    def chunks():
+        yield '<collection xmlns="http://www.loc.gov/MARC21/slim">\n'
+        for record in records:
+            for chunk in marcxml_record(record, hidden_tags):
+                yield chunk
+        yield '\n</collection>'
+    return buffered(chunks())
+
+
+def xslt(records, of, user_info=None):
+    """Transform the records of a page with the format XSLT template.
+
+    The records are serialized to a single MARCXML ``<collection>`` parsed
+    once, and each record is transformed with the cached compiled
+    stylesheet.  The collection template of the output format (e.g.
+    ``records/xd.tpl``) then wraps the outputs as usual.
+
+    :return: mapping of record identifiers to their output
+    """
+    from flask_login import current_user
+
+    from .engine import get_output_format
+    from .xslt import transform_records
+
+    records = list(records)
+    hidden_tags = _hidden_tags(user_info or current_user)
+    collection = ['<collection>\n']
+    for record in records:
+        collection.extend(marcxml_record(record, hidden_tags))
+    collection.append('\n</collection>')
+    outputs = transform_records(''.join(collection),
+                                get_output_format(of)['default'])
+    return dict(zip([record['recid'] for record in records], outputs))
@@ -20,12 +20,16 @@
 from flask import session
 from invenio.base.globals import cfg
 from invenio.ext.template import render_template_to_string
+from invenio_formatter.hits import LEGACY_SESSION_KEY, HitList, load_hits
 
 """
 Template context function - Display links (previous, next, back-to-search)
 to navigate through the records.
 """
 
+# the links depend on the session, they are filled in by the second pass
+needs_2nd_pass = True
+
 
 def template_context_function(recID):
     """
@@ -46,18 +50,32 @@ def template_context_function(recID):
     # any search before
     try:
         last_query = session['websearch-last-query']
-        recids = session["websearch-last-query-hits"]
-    except:
+    except KeyError:
         return ""
 
-    if recids:
-        return render_template_to_string(
-            'records/back_to_search_links.html',
-            recID=int(recID),
-            last_query=cfg['CFG_SITE_URL'] +
-            last_query,
-            recids=recids)
-    else:
+    # the hits are stored server-side with only a key in the session,
+    # older sessions still carry the whole list
+    hits = load_hits()
+    if hits is None and session.get(LEGACY_SESSION_KEY):
+        hits = HitList(session[LEGACY_SESSION_KEY])
+    if not hits:
         # did not rich the limit CFG_WEBSEARCH_PREV_NEXT_HIT_LIMIT,
         # so nothing is displayed
         return ""
+
+    try:
+        recid = int(recID)
+        previous, next_ = hits.neighbours(recid)
+    except ValueError:
+        return ""
+
+    return render_template_to_string(
+        'format/back_to_search_links.html',
+        recID=recid,
+        last_query=cfg['CFG_SITE_URL'] + last_query,
+        first=hits[0],
+        previous=previous,
+        next=next_,
+        last=hits[-1],
+        position=hits.index(recid) + 1,
+        total=len(hits))
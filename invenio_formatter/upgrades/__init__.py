@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Formatter upgrade recipes and helpers for large tables.
+
+Data migrations run in batches of primary key ranges, each in its own
+statement, so that tables are locked only briefly.  Large tables are
+altered online, on a copy that replaces them once it is filled.  Recipes
+estimate their running time from the number of rows of the tables they
+touch.
+"""
+
+import logging
+import time
+
+ROWS_PER_SECOND = 20000
+"""Number of rows migrated or copied per second assumed by estimates."""
+
+logger = logging.getLogger('invenio_upgrader')
+
+
+def count_rows(table):
+    """Return the (approximate) number of rows of ``table``.
+
+    The statistics of the database are used when available, which avoids
+    counting the rows of large tables; missing tables have no rows.
+    """
+    from invenio.legacy.dbquery import run_sql
+
+    try:
+        res = run_sql("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                      "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s",
+                      (table, ))
+        if res and res[0][0] is not None:
+            return int(res[0][0])
+        if not res:
+            return 0
+    except Exception:
+        pass
+    try:
+        return int(run_sql("SELECT COUNT(*) FROM {0}".format(table))[0][0])
+    except Exception:
+        return 0
+
+
+def estimate_time(*tables, **kwargs):
+    """Estimate in seconds the time needed to process all rows of ``tables``.
+
+    :param rows_per_second: processing speed (defaults to
+        :data:`ROWS_PER_SECOND`)
+    """
+    rows_per_second = kwargs.get('rows_per_second', ROWS_PER_SECOND)
+    rows = sum(count_rows(table) for table in tables)
+    return max(1, int(rows / float(rows_per_second)))
+
+
+def run_batched(query, table, key, batch_size=1000, throttle=0.05):
+    """Run ``query`` on ``table`` in batches of ``key`` ranges.
+
+    The query is executed once per range of ``batch_size`` values of the
+    integer column ``key``, with the lower (inclusive) and upper
+    (exclusive) bounds of the range as its two parameters, e.g.::
+
+        run_batched('UPDATE t SET a=b WHERE id>=%s AND id<%s', 't', 'id')
+
+    Progress is logged and the helper sleeps ``throttle`` seconds between
+    batches to let other queries through.
+
+    :return: number of affected rows
+    """
+    from invenio.legacy.dbquery import run_sql
+
+    min_key, max_key = run_sql("SELECT MIN({0}), MAX({0}) FROM {1}".format(
+        key, table))[0]
+    if min_key is None:
+        return 0
+
+    batches = (max_key - min_key) // batch_size + 1
+    count = 0
+    for i, low in enumerate(range(min_key, max_key + 1, batch_size)):
+        count += run_sql(query, (low, low + batch_size)) or 0
+        if (i + 1) % 100 == 0 or i + 1 == batches:
+            logger.info("%s: %d/%d batches done (%d rows)", table, i + 1,
+                        batches, count)
+        if throttle:
+            time.sleep(throttle)
+    return count
+
+
+def has_column(table, column):
+    """Check if ``table`` has the column ``column``."""
+    from invenio.legacy.dbquery import run_sql
+
+    return bool(run_sql("SHOW COLUMNS FROM {0} LIKE %s".format(table),
+                        (column, )))
+
+
+def has_index(table, index):
+    """Check if ``table`` has the index ``index``."""
+    from invenio.legacy.dbquery import run_sql
+
+    return bool(run_sql("SHOW INDEX FROM {0} WHERE Key_name=%s".format(
+        table), (index, )))
+
+
+def alter_online(table, clauses, key, modified_column=None,
+                 batch_size=1000, throttle=0.05):
+    """Apply ``ALTER TABLE`` ``clauses`` to ``table`` without locking it.
+
+    The clauses are applied to an empty copy of the table, which is filled
+    with :func:`run_batched` in ranges of ``key`` and then swapped with
+    the table.  Rows of the table modified during the copy, i.e. with a
+    ``modified_column`` more recent than its start, are copied again after
+    the swap, e.g.::
+
+        alter_online('bibfmt', ['ADD INDEX ix_kind (kind)'], 'id_bibrec',
+                     modified_column='last_updated')
+
+    :return: number of copied rows
+    """
+    from invenio.legacy.dbquery import run_sql
+
+    new, old = table + '_new', table + '_old'
+    run_sql("DROP TABLE IF EXISTS {0}".format(new))
+    run_sql("CREATE TABLE {0} LIKE {1}".format(new, table))
+    run_sql("ALTER TABLE {0} {1}".format(new, ', '.join(clauses)))
+
+    new_columns = set(row[0] for row in run_sql(
+        "SHOW COLUMNS FROM {0}".format(new)))
+    columns = ', '.join('`{0}`'.format(row[0]) for row in run_sql(
+        "SHOW COLUMNS FROM {0}".format(table)) if row[0] in new_columns)
+
+    start = run_sql("SELECT NOW()")[0][0]
+    count = run_batched(
+        "INSERT IGNORE INTO {0} ({1}) SELECT {1} FROM {2} "
+        "WHERE {3}>=%s AND {3}<%s".format(new, columns, table, key),
+        table, key, batch_size=batch_size, throttle=throttle)
+    run_sql("RENAME TABLE {0} TO {1}, {2} TO {0}".format(table, old, new))
+    if modified_column is not None:
+        run_sql("REPLACE INTO {0} ({1}) SELECT {1} FROM {2} "
+                "WHERE {3}>=%s".format(table, columns, old, modified_column),
+                (start, ))
+    run_sql("DROP TABLE {0}".format(old))
+    logger.info("%s: altered online (%d rows copied)", table, count)
+    return count
@@ -22,6 +22,7 @@
 import warnings
 import sqlalchemy as sa
 from sqlalchemy.dialects import mysql
+from invenio_formatter.upgrades import estimate_time
 from invenio_upgrader.api import op
 from sqlalchemy.exc import OperationalError
 
@@ -59,7 +60,7 @@ def do_upgrade():
 
 def estimate():
     """Estimate running time of upgrade in seconds (optional)."""
-    return 1
+    return estimate_time('bibfmt')
 
 
 def pre_upgrade():
@@ -22,7 +22,7 @@
 import warnings
 
 from invenio.ext.sqlalchemy import db
-from invenio.legacy.dbquery import run_sql
+from invenio_formatter.upgrades import estimate_time, run_batched
 from invenio_upgrader.api import op
 
 depends_on = [u'formatter_2014_10_29_add_mime_type']
@@ -37,8 +37,10 @@ def do_upgrade():
     """Migrate format references."""
     op.add_column('collection_format',
                   db.Column('format', db.String(length=10), nullable=False))
-    run_sql('UPDATE collection_format cf JOIN format f ON f.id = cf.id_format '
-            'SET cf.format = f.code')
+    run_batched('UPDATE collection_format cf JOIN format f '
+                'ON f.id = cf.id_format SET cf.format = f.code '
+                'WHERE cf.id_collection >= %s AND cf.id_collection < %s',
+                'collection_format', 'id_collection')
     op.drop_constraint(None, 'collection_format', type_='primary')
     op.create_primary_key(None, 'collection_format',
                           ['id_collection', 'format'])
@@ -49,7 +51,7 @@ def do_upgrade():
 
 def estimate():
     """Estimate running time of upgrade in seconds (optional)."""
-    return 1
+    return estimate_time('collection_format')
 
 
 def pre_upgrade():
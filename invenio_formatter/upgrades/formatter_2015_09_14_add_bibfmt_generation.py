@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add table bibfmt_generation for cache invalidation."""
+
+from invenio.ext.sqlalchemy import db
+from invenio_upgrader.api import op
+
+depends_on = [u'formatter_2015_09_07_add_bibfmt_encoding']
+
+
+def info():
+    """Return upgrade info."""
+    return __doc__
+
+
+def do_upgrade():
+    """Create the table."""
+    op.create_table(
+        'bibfmt_generation',
+        db.Column('format', db.String(length=10), server_default='',
+                  nullable=False),
+        db.Column('generation', db.Integer(15, unsigned=True),
+                  server_default='0', nullable=False),
+        db.Column('invalidated', db.DateTime(),
+                  server_default='1900-01-01 00:00:00', nullable=False),
+        db.PrimaryKeyConstraint('format'),
+        mysql_charset='utf8',
+        mysql_engine='MyISAM'
+    )
+
+
+def estimate():
+    """Estimate running time of upgrade in seconds (optional)."""
+    return 1
+
+
+def pre_upgrade():
+    """Run pre-upgrade checks (optional)."""
+    pass
+
+
+def post_upgrade():
+    """Run post-upgrade checks (optional)."""
+    pass
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add table bibfmt_refresh queueing stale cached formats."""
+
+from invenio.ext.sqlalchemy import db
+from invenio_upgrader.api import op
+
+depends_on = [u'formatter_2015_09_14_add_bibfmt_generation']
+
+
+def info():
+    """Return upgrade info."""
+    return __doc__
+
+
+def do_upgrade():
+    """Create the table."""
+    op.create_table(
+        'bibfmt_refresh',
+        db.Column('id_bibrec', db.MediumInteger(8, unsigned=True),
+                  server_default='0', nullable=False),
+        db.Column('format', db.String(length=10), server_default='',
+                  nullable=False),
+        db.Column('queued', db.DateTime(),
+                  server_default='1900-01-01 00:00:00', nullable=False),
+        db.PrimaryKeyConstraint('id_bibrec', 'format'),
+        mysql_charset='utf8',
+        mysql_engine='MyISAM'
+    )
+    op.create_index(op.f('ix_bibfmt_refresh_queued'), 'bibfmt_refresh',
+                    ['queued'], unique=False)
+
+
+def estimate():
+    """Estimate running time of upgrade in seconds (optional)."""
+    return 1
+
+
+def pre_upgrade():
+    """Run pre-upgrade checks (optional)."""
+    pass
+
+
+def post_upgrade():
+    """Run post-upgrade checks (optional)."""
+    pass
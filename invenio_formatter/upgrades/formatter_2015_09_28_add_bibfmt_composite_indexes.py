@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add composite indexes on bibfmt for cache maintenance queries.
+
+The index on kind alone is dropped, the (kind, format) one covers it.
+"""
+
+from invenio_formatter.upgrades import alter_online, estimate_time, \
+    has_index
+
+depends_on = [u'formatter_2015_09_21_add_bibfmt_refresh']
+
+
+def info():
+    """Return upgrade info."""
+    return __doc__
+
+
+def do_upgrade():
+    """Create the indexes and drop the redundant one."""
+    clauses = ['ADD INDEX {0} ({1})'.format(name, columns)
+               for name, columns in (
+                   ('ix_bibfmt_format_last_updated', 'format, last_updated'),
+                   ('ix_bibfmt_kind_format', 'kind, format'))
+               if not has_index('bibfmt', name)]
+    # the (kind, format) index serves the queries on kind alone
+    if has_index('bibfmt', 'ix_bibfmt_kind'):
+        clauses.append('DROP INDEX ix_bibfmt_kind')
+    if clauses:
+        alter_online('bibfmt', clauses, 'id_bibrec',
+                     modified_column='last_updated')
+
+
+def estimate():
+    """Estimate running time of upgrade in seconds (optional)."""
+    return estimate_time('bibfmt')
+
+
+def pre_upgrade():
+    """Run pre-upgrade checks (optional)."""
+    pass
+
+
+def post_upgrade():
+    """Run post-upgrade checks (optional)."""
+    pass
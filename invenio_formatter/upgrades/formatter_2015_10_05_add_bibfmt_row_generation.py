@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add column 'generation' to bibfmt stamping the generation of rows."""
+
+from invenio_formatter.upgrades import alter_online, estimate_time, \
+    has_column
+
+depends_on = [u'formatter_2015_09_28_add_bibfmt_composite_indexes']
+
+
+def info():
+    """Return upgrade info."""
+    return __doc__
+
+
+def do_upgrade():
+    """Add the column."""
+    if not has_column('bibfmt', 'generation'):
+        alter_online('bibfmt',
+                     ["ADD COLUMN generation INT(15) UNSIGNED NOT NULL "
+                      "DEFAULT '0'"],
+                     'id_bibrec', modified_column='last_updated')
+
+
+def estimate():
+    """Estimate running time of upgrade in seconds (optional)."""
+    return estimate_time('bibfmt')
+
+
+def pre_upgrade():
+    """Run pre-upgrade checks (optional)."""
+    pass
+
+
+def post_upgrade():
+    """Run post-upgrade checks (optional)."""
+    pass
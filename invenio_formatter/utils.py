@@ -21,23 +21,121 @@
 """Define utilities for special formatting of records."""
 
 import datetime
+import itertools
 import time
+import zlib
 
-from flask import current_app, make_response
+from flask import Response, current_app, make_response, request, \
+    stream_with_context
 from flask_login import current_user
+from six import text_type
 from werkzeug.http import http_date
+from werkzeug.wsgi import wrap_file
 
-from .api import get_output_format_content_type
-from .engine import format_records
+from .api import get_format_property, get_output_format_content_type
+from .blobs import get_blob_store
+from .cache import BLOB_PREFIX, content_encoding, get_cached, \
+    is_cached_format, iter_decoded_value, iter_value_chunks
+from .engine import _can_serve_cached, format_record, format_records, \
+    iter_format_records
 
 
 def response_formated_records(records, of, **kwargs):
     """Return formatter records.
 
     Response contains correct Cache and TTL information in HTTP headers.
+
+    Output formats with the ``compression`` property (``level`` and
+    ``min_size``) are compressed with gzip chunk by chunk while they are
+    rendered, for clients accepting it.
+    """
+    compression = get_format_property(of, 'compression')
+    if compression and request.accept_encodings['gzip']:
+        response = _response_gzip_stream(
+            iter_format_records(records, of=of, **kwargs),
+            level=compression.get('level', 6),
+            min_size=compression.get('min_size', 0))
+    else:
+        response = make_response(format_records(records, of=of, **kwargs))
+    response.mimetype = get_output_format_content_type(of)
+    return _set_cache_headers(response)
+
+
+def response_formated_record(record, of, **kwargs):
+    """Return a single formatted record.
+
+    Renderings cached compressed in the bibfmt table are sent as they are
+    with the matching ``Content-Encoding`` when the client accepts it, and
+    decompressed only for the other clients.  Renderings kept in the blob
+    store are sent from their file, the other ones are streamed from the
+    database in chunks.  Cached renderings are only served to guests.
     """
-    response = make_response(format_records(records, of=of, **kwargs))
+    row = None
+    if not kwargs and is_cached_format(of) and current_user.is_guest:
+        row = get_cached(record['recid'], of, with_value=False)
+        if row is not None and (row.needs_2nd_pass or
+                                not _can_serve_cached(record, of, row)):
+            row = None
+
+    if row is None:
+        response = make_response(format_record(record, of, **kwargs))
+    elif content_encoding(row.encoding) and \
+            request.accept_encodings[content_encoding(row.encoding)]:
+        if row.encoding.startswith(BLOB_PREFIX):
+            response = Response(wrap_file(request.environ, open(
+                get_blob_store().path(row.value.decode('ascii')), 'rb')),
+                direct_passthrough=True)
+        else:
+            response = Response(stream_with_context(iter_value_chunks(row)))
+        response.headers['Content-Encoding'] = content_encoding(row.encoding)
+        response.vary.add('Accept-Encoding')
+    else:
+        response = Response(stream_with_context(iter_decoded_value(row)))
+        response.vary.add('Accept-Encoding')
     response.mimetype = get_output_format_content_type(of)
+    return _set_cache_headers(response)
+
+
+def _encode(chunk):
+    """Encode a text ``chunk`` in UTF-8; bytes are returned unchanged."""
+    if isinstance(chunk, text_type):
+        return chunk.encode('utf-8')
+    return chunk
+
+
+def _gzip_stream(chunks, level):
+    """Compress text or bytes ``chunks`` to the gzip format one by one."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(_encode(chunk))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _response_gzip_stream(chunks, level, min_size):
+    """Return a streamed gzip response unless the output is small."""
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            break
+    else:
+        response = make_response(b''.join(_encode(chunk) for chunk in head))
+        response.vary.add('Accept-Encoding')
+        return response
+
+    response = Response(stream_with_context(
+        _gzip_stream(itertools.chain(head, chunks), level)))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _set_cache_headers(response):
+    """Set Cache and TTL information in HTTP headers of ``response``."""
     current_time = datetime.datetime.now()
     response.headers['Last-Modified'] = http_date(
         time.mktime(current_time.timetuple())
@@ -53,7 +151,7 @@ def response_formated_records(records, of, **kwargs):
         response.headers['Expires'] = '-1'
     else:
         expires_time = current_time + datetime.timedelta(seconds=expires)
-        response.headers['Vary'] = 'Accept'
+        response.vary.add('Accept')
         response.headers['Cache-Control'] = (
             'public' if current_user.is_guest else 'private'
         )
@@ -16,12 +16,158 @@
 # You should have received a copy of the GNU General Public License
 # along with Invenio; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
-
 """Formater Blueprint."""
 
 from __future__ import unicode_literals
 
-from flask import Blueprint
+import datetime
+import os
+
+from flask import Blueprint, abort, current_app, request, send_file
+from invenio.base.globals import cfg
+
+from .config import CFG_BIBFORMAT_EXPORT_ACCEL_REDIRECT, \
+    CFG_BIBFORMAT_EXPORT_ACCESS_ACTION, CFG_BIBFORMAT_OFFLOAD_PROCESSES
 
 blueprint = Blueprint('formatter', __name__,
                       template_folder='templates', static_folder='static')
+
+
+@blueprint.record_once
+def register_extensions(state):
+    """Register Jinja extensions for format templates."""
+    state.app.jinja_env.add_extension(
+        'invenio_formatter.extensions.FragmentCacheExtension')
+
+
+@blueprint.record_once
+def start_offload_pool(state):
+    """Start the worker processes rendering offloaded exports."""
+    from .offload import start_offload_pool
+
+    start_offload_pool(state.app.config.get(
+        'CFG_BIBFORMAT_OFFLOAD_PROCESSES', CFG_BIBFORMAT_OFFLOAD_PROCESSES))
+
+
+@blueprint.app_after_request
+def move_search_hits(response):
+    """Keep the hits of the last search out of the session cookie."""
+    from .hits import move_session_hits
+    move_session_hits()
+    return response
+
+
+def _read_range(path, start, stop, chunk_size=64 * 1024):
+    """Yield the bytes of ``path`` from ``start`` to ``stop`` in chunks."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _send_export_file(path, etag, last_modified):
+    """Send an export file honouring conditional and range requests.
+
+    With ``CFG_BIBFORMAT_EXPORT_ACCEL_REDIRECT`` or ``USE_X_SENDFILE`` the
+    web server sends the file and handles range requests itself.
+    """
+    from werkzeug.datastructures import ContentRange
+    from werkzeug.http import http_date
+
+    from .export import get_export_dir
+
+    accel_redirect = cfg.get('CFG_BIBFORMAT_EXPORT_ACCEL_REDIRECT',
+                             CFG_BIBFORMAT_EXPORT_ACCEL_REDIRECT)
+    if current_app.use_x_sendfile and not accel_redirect:
+        response = send_file(path, mimetype='application/gzip',
+                             as_attachment=True, add_etags=False,
+                             conditional=False)
+    else:
+        response = current_app.response_class(mimetype='application/gzip',
+                                              direct_passthrough=True)
+        response.headers.add('Content-Disposition', 'attachment',
+                             filename=os.path.basename(path))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+
+    if accel_redirect:
+        response.headers['X-Accel-Redirect'] = '{0}/{1}'.format(
+            accel_redirect.rstrip('/'),
+            os.path.relpath(path, get_export_dir()).replace(os.sep, '/'))
+    elif not current_app.use_x_sendfile:
+        size = os.path.getsize(path)
+        start, stop = 0, size
+        response.accept_ranges = 'bytes'
+        # a range of a different version of the file is not sent, and
+        # the whole file is sent for multiple ranges
+        if request.range is not None and \
+                len(request.range.ranges) == 1 and request.headers.get(
+                'If-Range', response.headers['ETag']) in (
+                    response.headers['ETag'], http_date(last_modified)):
+            bounds = request.range.range_for_length(size)
+            if bounds is None:
+                response.status_code = 416
+                response.content_range = ContentRange('bytes', None, None,
+                                                      size)
+                return response
+            start, stop = bounds
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+        response.response = _read_range(path, start, stop)
+        response.content_length = stop - start
+
+    return response.make_conditional(request)
+
+
+def _check_export_access(of):
+    """Abort unless the current user may download exports of ``of``."""
+    from flask_login import current_user
+    from invenio.modules.access.engine import acc_authorize_action
+
+    from .registry import output_formats
+
+    if of.lower() not in output_formats:
+        abort(404)
+    action = cfg.get('CFG_BIBFORMAT_EXPORT_ACCESS_ACTION',
+                     CFG_BIBFORMAT_EXPORT_ACCESS_ACTION)
+    if action:
+        auth_code, dummy = acc_authorize_action(current_user, action)
+        if auth_code:
+            abort(401 if current_user.is_guest else 403)
+
+
+@blueprint.route('/export/<of>/')
+def export_manifest(of):
+    """Send the manifest of the last export of output format ``of``."""
+    from .export import MANIFEST, get_export_dir
+
+    _check_export_access(of)
+    path = os.path.join(get_export_dir(of.lower()), MANIFEST)
+    if not os.path.isfile(path):
+        abort(404)
+    return send_file(path, mimetype='application/json', conditional=True)
+
+
+@blueprint.route('/export/<of>/<name>')
+def export_file(of, name):
+    """Send a file of the last export of output format ``of``."""
+    from .export import get_export_dir, load_manifest
+
+    _check_export_access(of)
+    manifest = load_manifest(of.lower())
+    if manifest is None:
+        abort(404)
+    for item in manifest['files']:
+        if item['name'] == name:
+            break
+    else:
+        abort(404)
+    last_modified = datetime.datetime.strptime(manifest['created'],
+                                               '%Y-%m-%dT%H:%M:%SZ')
+    return _send_export_file(os.path.join(get_export_dir(of.lower()), name),
+                             item['sha1'], last_modified)
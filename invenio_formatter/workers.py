@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Applications of the worker processes of the formatter.
+
+Worker processes of the offloaded renders and of the exports create their
+own application when they start.  Applications created in a worker never
+start worker processes themselves.
+"""
+
+_app = None
+"""Application of the current worker process."""
+
+
+def init_worker():
+    """Create the application of a worker process."""
+    global _app
+    from invenio.base.factory import create_app
+
+    _app = False  # in_worker() while the application is created
+    _app = create_app()
+
+
+def get_worker_app():
+    """Return the application of the current worker process."""
+    return _app
+
+
+def in_worker():
+    """Check if the current process is a worker process."""
+    return _app is not None
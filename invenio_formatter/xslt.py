@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Apply XSLT format templates to MARCXML."""
+
+import os
+import threading
+
+from six import text_type
+
+from . import registry
+from .config import InvenioBibFormatError
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
+FUNCTION_NS = 'http://cdsweb.cern.ch/bibformat/fn'
+"""Namespace of the BibFormat extension functions used by stylesheets."""
+
+_stylesheets = {}
+_stylesheets_lock = threading.Lock()
+
+
+def _text(value):
+    """Return the text of an XPath argument (node-set, string or number)."""
+    if isinstance(value, list):
+        value = value[0] if value else ''
+        value = getattr(value, 'text', value)
+    if isinstance(value, float):
+        value = int(value)
+    return text_type(value or '')
+
+
+def creation_date(context, recid, fmt='%Y-%m-%dT%H:%M:%S'):
+    """Return the creation date of record ``recid`` (``fn:creation_date``)."""
+    from invenio.legacy.search_engine import get_creation_date
+    return get_creation_date(int(_text(recid)), fmt=_text(fmt))
+
+
+def eval_bibformat(context, recid, template_code):
+    """Evaluate BibFormat elements of ``template_code`` for ``recid``.
+
+    Implements ``fn:eval_bibformat`` with the legacy BibFormat engine.
+    """
+    from invenio.legacy.bibformat.engine import BibFormatObject, \
+        format_with_format_template
+
+    out = format_with_format_template(
+        None, BibFormatObject(int(_text(recid))), verbose=0,
+        format_template_code=_text(template_code))
+    # newer versions also return whether a second pass is needed
+    return out[0] if isinstance(out, tuple) else out
+
+
+def register_functions():
+    """Register the extension functions in the BibFormat namespace."""
+    functions = etree.FunctionNamespace(FUNCTION_NS)
+    functions['creation_date'] = creation_date
+    functions['eval_bibformat'] = eval_bibformat
+
+
+def get_stylesheet(name):
+    """Return the compiled XSLT transformer for the format template ``name``.
+
+    Compiled stylesheets are kept for the lifetime of the process and are
+    compiled again only when the modification time of the file changes.
+
+    :param name: name of the format template (e.g. ``DC.xsl``)
+    :return: :class:`lxml.etree.XSLT` instance
+    """
+    if etree is None:
+        raise InvenioBibFormatError("lxml is required to apply '{0}'".format(
+            name))
+    try:
+        path = registry.format_templates_lookup[name]
+    except KeyError:
+        raise InvenioBibFormatError(
+            "Missing format template '{0}'".format(name))
+
+    key = (path, os.path.getmtime(path))
+    transformer = _stylesheets.get(key)
+    if transformer is None:
+        with _stylesheets_lock:
+            transformer = _stylesheets.get(key)
+            if transformer is None:
+                register_functions()
+                transformer = etree.XSLT(etree.parse(path))
+                for old_key in [k for k in _stylesheets if k[0] == path]:
+                    del _stylesheets[old_key]
+                _stylesheets[key] = transformer
+    return transformer
+
+
+def transform_records(xml, name):
+    """Transform each record of a MARCXML collection with template ``name``.
+
+    The collection is parsed once and every ``<record>`` is transformed on
+    its own with the cached compiled stylesheet, giving the output of the
+    template for a single record.
+
+    :param xml: MARCXML ``<collection>`` as text
+    :param name: name of the format template (e.g. ``DC.xsl``)
+    :return: list of the transformed records as text
+    """
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    transformer = get_stylesheet(name)
+    return [bytes(transformer(record)).decode('utf-8')
+            for record in etree.fromstring(xml)]
+
+
+def transform(xml, name):
+    """Transform a MARCXML record or collection with the template ``name``.
+
+    A whole ``<collection>`` is transformed with a single call, so the cost
+    of parsing the input and setting up the transformation is paid once for
+    all the records of a page.
+
+    :param xml: MARCXML document as text
+    :param name: name of the format template (e.g. ``DC.xsl``)
+    :return: transformed document as text
+    """
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    transformer = get_stylesheet(name)
+    result = transformer(etree.fromstring(xml))
+    return bytes(result).decode('utf-8')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the store of large cached renderings."""
+
+import os
+import shutil
+import tempfile
+import time
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+
+class BlobStoreTest(InvenioTestCase):
+
+    """Test the content-addressed blob store."""
+
+    def setUp(self):
+        """Create a store in a temporary directory."""
+        from invenio_formatter.blobs import BlobStore
+
+        self.directory = tempfile.mkdtemp()
+        self.store = BlobStore(self.directory)
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.directory)
+
+    def test_put_and_open(self):
+        """Store a blob once and read it back."""
+        digest = self.store.put(b'rendering')
+        self.assertEqual(self.store.put(b'rendering'), digest)
+        self.assertTrue(self.store.exists(digest))
+        self.assertEqual(list(self.store.digests()), [digest])
+        with self.store.open(digest) as data:
+            self.assertEqual(data[:], b'rendering')
+
+    def test_empty_blob(self):
+        """Read an empty blob, which cannot be mapped."""
+        digest = self.store.put(b'')
+        with self.store.open(digest) as data:
+            self.assertEqual(data[:], b'')
+
+    def test_missing_blob(self):
+        """A missing blob does not exist and cannot be opened."""
+        digest = '0' * 64
+        self.assertFalse(self.store.exists(digest))
+
+        def read():
+            with self.store.open(digest):
+                pass
+        self.assertRaises(IOError, read)
+
+    def test_put_refreshes_existing_blob(self):
+        """Storing an existing blob makes it recent again."""
+        digest = self.store.put(b'rendering')
+        path = self.store.path(digest)
+        os.utime(path, (0, 0))
+        self.store.put(b'rendering')
+        self.assertTrue(os.path.getmtime(path) > time.time() - 60)
+
+    def test_remove_unused(self):
+        """Remove old blobs that are not used only."""
+        used = self.store.put(b'used')
+        unused = self.store.put(b'unused')
+        recent = self.store.put(b'recent')
+        for digest in (used, unused):
+            os.utime(self.store.path(digest), (0, 0))
+        self.assertEqual(self.store.remove_unused(set([used])), 1)
+        self.assertTrue(self.store.exists(used))
+        self.assertFalse(self.store.exists(unused))
+        self.assertTrue(self.store.exists(recent))
+
+
+TEST_SUITE = make_test_suite(BlobStoreTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
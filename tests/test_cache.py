@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the cache of formatted records."""
+
+import datetime
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+
+class BulkSetCachedValuesTest(InvenioTestCase):
+
+    """Test bulk writes of cached formats in an SQLite database."""
+
+    def setUp(self):
+        """Create the bibfmt table in an in-memory database."""
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import StaticPool
+        from invenio_formatter import cache
+        from invenio_formatter.models import Bibfmt
+
+        self.engine = create_engine('sqlite://', poolclass=StaticPool)
+        self.table = Bibfmt.__table__
+        self.table.create(self.engine)
+        # the generation table lives in the database of the application
+        self.get_generation = cache.get_generation
+        cache.get_generation = lambda of: 3
+
+    def tearDown(self):
+        """Drop the in-memory database."""
+        from invenio_formatter import cache
+
+        cache.get_generation = self.get_generation
+        self.engine.dispose()
+
+    def _rows(self):
+        """Return the stored ``(id_bibrec, format, value)`` rows."""
+        from invenio_formatter.cache import decode_value
+
+        with self.engine.connect() as connection:
+            return sorted(
+                (row.id_bibrec, row.format,
+                 decode_value(row.value, row.encoding))
+                for row in connection.execute(self.table.select()))
+
+    def _write(self, values, generation=(), **kwargs):
+        """Write ``values`` of records 1, 2, ... in format HB."""
+        from invenio_formatter.cache import bulk_set_cached_values
+
+        now = datetime.datetime.now()
+        return bulk_set_cached_values(
+            [(recid, 'hb', '', value, now, False) + generation
+             for recid, value in enumerate(values, 1)],
+            connectable=self.engine, **kwargs)
+
+    def _generations(self):
+        """Return the stored generations by record identifier."""
+        with self.engine.connect() as connection:
+            return dict((row.id_bibrec, row.generation)
+                        for row in connection.execute(self.table.select()))
+
+    def test_insert_and_update(self):
+        """Insert new rows and update existing ones in place."""
+        self.assertEqual(self._write(['a', 'b', 'c'], batch_size=2), 3)
+        self.assertEqual(self._write(['A', 'B']), 2)
+        self.assertEqual(self._rows(), [(1, 'HB', 'A'), (2, 'HB', 'B'),
+                                        (3, 'HB', 'c')])
+
+    def test_generation(self):
+        """Stamp rows with the given or the current generation."""
+        self._write(['a'])
+        self._write(['A', 'b'], generation=(2, ))
+        self.assertEqual(self._generations(), {1: 2, 2: 2})
+        self._write(['a'], generation=(None, ))
+        self.assertEqual(self._generations(), {1: 3, 2: 2})
+
+    def test_delete_and_insert(self):
+        """Replace rows when the database has no upsert statement."""
+        from invenio_formatter import cache
+
+        self._write(['a', 'b', 'c'])
+        upsert_statement = cache._upsert_statement
+        cache._upsert_statement = lambda dialect: None
+        try:
+            self.assertEqual(self._write(['A', 'B'], batch_size=1), 2)
+        finally:
+            cache._upsert_statement = upsert_statement
+        self.assertEqual(self._rows(), [(1, 'HB', 'A'), (2, 'HB', 'B'),
+                                        (3, 'HB', 'c')])
+
+
+TEST_SUITE = make_test_suite(BulkSetCachedValuesTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the two-pass rendering of cached formats."""
+
+import base64
+import json
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+
+class SecondPassTest(InvenioTestCase):
+
+    """Test the replacement of first pass placeholders."""
+
+    nonce = '0123456789abcdef0123456789abcdef'
+
+    def setUp(self):
+        """Register a template context function."""
+        from invenio_formatter.engine import TEMPLATE_CONTEXT_FUNCTIONS_CACHE
+
+        self.functions = \
+            TEMPLATE_CONTEXT_FUNCTIONS_CACHE.template_context_functions
+        self.functions['tfn_test'] = lambda value: '<{0}>'.format(value)
+
+    def tearDown(self):
+        """Unregister the template context function."""
+        del self.functions['tfn_test']
+
+    def _placeholder(self, name, nonce=None):
+        """Return a placeholder of a call of ``name`` with argument 1."""
+        from invenio_formatter.engine import SECOND_PASS_PLACEHOLDER
+
+        payload = base64.urlsafe_b64encode(
+            json.dumps([[1], {}]).encode('utf-8')).decode('ascii')
+        return SECOND_PASS_PLACEHOLDER.format(nonce or self.nonce, name,
+                                              payload)
+
+    def test_replace(self):
+        """Replace placeholders bound to the nonce of the rendering."""
+        from invenio_formatter.engine import SECOND_PASS_HEADER, second_pass
+
+        out = SECOND_PASS_HEADER.format(self.nonce) + 'a{0}b'.format(
+            self._placeholder('tfn_test'))
+        self.assertEqual(second_pass(out), 'a<1>b')
+
+    def test_forged_placeholders(self):
+        """Keep placeholders of another nonce or of unknown functions."""
+        from invenio_formatter.engine import SECOND_PASS_HEADER, second_pass
+
+        forged = self._placeholder('tfn_test', 'f' * 32)
+        unknown = self._placeholder('tfn_unknown')
+        out = SECOND_PASS_HEADER.format(self.nonce) + forged + unknown
+        self.assertEqual(second_pass(out), forged + unknown)
+        self.assertEqual(second_pass(self._placeholder('tfn_test')),
+                         self._placeholder('tfn_test'))
+
+
+TEST_SUITE = make_test_suite(SecondPassTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
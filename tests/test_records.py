@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the loading of records to format."""
+
+import datetime
+from collections import namedtuple
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+Row = namedtuple('Row', ['last_updated'])
+
+
+class ProjectionTest(InvenioTestCase):
+
+    """Test records restricted to the formatted fields."""
+
+    modified = datetime.datetime(2015, 10, 1)
+
+    def _project(self):
+        """Return a record projected on its title."""
+        from invenio_formatter.records import _project
+
+        return _project({'recid': 1, '_id': 1, 'title': 'Title',
+                         'abstract': 'Abstract',
+                         'modification_date': self.modified}, ['title'])
+
+    def test_keeps_modification_date(self):
+        """Keep the fields, the identifiers and the modification date."""
+        self.assertEqual(self._project(), {
+            'recid': 1, '_id': 1, 'title': 'Title',
+            'modification_date': self.modified})
+
+    def test_stale_rendering_of_projected_record(self):
+        """A rendering older than a projected record is not served."""
+        from invenio_formatter.engine import _can_serve_cached
+
+        record = self._project()
+        self.assertFalse(_can_serve_cached(
+            record, 'hb', Row(self.modified - datetime.timedelta(days=1))))
+        self.assertTrue(_can_serve_cached(
+            record, 'hb', Row(self.modified + datetime.timedelta(days=1))))
+
+
+TEST_SUITE = make_test_suite(ProjectionTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test that native serializers render like the collection templates."""
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, \
+    run_test_suite
+
+MARCXML = """<record>
+  <controlfield tag="001">1</controlfield>
+  <datafield tag="100" ind1=" " ind2=" ">
+    <subfield code="a">Doe, J&#233;r&#244;me</subfield>
+  </datafield>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">A &lt;b&gt;bold&lt;/b&gt; &amp; 'quoted' title
+      &lt;/script&gt;</subfield>
+  </datafield>
+  <datafield tag="520" ind1=" " ind2=" ">
+    <subfield code="a">An abstract.</subfield>
+  </datafield>
+  <datafield tag="980" ind1=" " ind2=" ">
+    <subfield code="a">ARTICLE</subfield>
+  </datafield>
+</record>"""
+
+
+class NativeSerializersTest(InvenioTestCase):
+
+    """Compare the native serializers with the Jinja templates."""
+
+    def setUp(self):
+        """Create the records to format."""
+        from invenio.modules.records.api import Record
+
+        self.records = [
+            Record.create(MARCXML, master_format='marc'),
+            Record.create(MARCXML.replace('>1<', '>2<'),
+                          master_format='marc'),
+        ]
+
+    def _format(self, of, native, url='/'):
+        """Format the records with or without the native serializer."""
+        from invenio_formatter.engine import format_records, \
+            get_native_serializer
+
+        self.app.config['CFG_BIBFORMAT_NATIVE_FORMATS'] = [of] if native \
+            else []
+        with self.app.test_request_context(url):
+            self.assertEqual(get_native_serializer(of) is not None, native)
+            return format_records(self.records, of=of)
+
+    def _assert_same_output(self, of, url='/'):
+        """Check that both paths render the same document."""
+        self.assertEqual(self._format(of, True, url),
+                         self._format(of, False, url))
+
+    def test_marcxml(self):
+        """Serialize MARCXML like ``records/xm.tpl``."""
+        self._assert_same_output('xm')
+
+    def test_recjson(self):
+        """Serialize JSON like ``records/recjson.tpl``."""
+        output = self._format('recjson', True)
+        self.assertTrue('}, {' in output)
+        self.assertTrue('</script>' not in output)
+        self._assert_same_output('recjson')
+
+    def test_recjson_fields(self):
+        """Serialize the fields given by ``ot`` like the template."""
+        self._assert_same_output('recjson', '/?ot=title,recid')
+
+
+TEST_SUITE = make_test_suite(NativeSerializersTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE, warn_user=True)